@@ -0,0 +1,109 @@
+"""
+Check that the fast mode of WrittenQueryProcessor gives the same output as
+the step by step pipeline on the original queries of the datasets, report the
+agreement of the simple sentence splitter with nltk's, and compare the
+throughputs of the modes and splitters
+"""
+
+import argparse
+import sys
+import time
+
+import pandas as pd
+from preprocessing import WrittenQueryProcessor, nltk_sent_tokenize
+
+
+def throughput(processor, sents, repeat):
+    """
+    Best number of queries processed per second over repeat runs
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        processor.processing_pipeline(sents)
+        best = min(best, time.perf_counter() - start)
+    return len(sents) / best
+
+
+def print_mismatches(sents, expected, results, max_printed=10):
+    """
+    Print the first differing outputs and return their number
+    """
+    mismatches = [
+        (sent, e, r) for sent, e, r in zip(sents, expected, results) if e != r
+    ]
+    for sent, e, r in mismatches[:max_printed]:
+        print(f"{sent!r}\n  expected {e!r}\n  got      {r!r}")
+    return len(mismatches)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data_dirs",
+        dest="data_dirs",
+        type=str,
+        nargs="+",
+        help="Data directories whose queries.csv original queries are processed",
+        default=[f"data/dataset{i}" for i in range(1, 5)],
+    )
+    parser.add_argument(
+        "--repeat",
+        dest="repeat",
+        type=int,
+        help="Number of timed runs per mode",
+        default=5,
+    )
+    args = parser.parse_args()
+
+    sents = []
+    preprocessed = []
+    for data_dir in args.data_dirs:
+        df = pd.read_csv(f"{data_dir}/queries.csv", keep_default_na=False)
+        sents += df["original"].tolist()
+        preprocessed += df["preprocessed"].tolist()
+
+    splitters = ["nltk", "simple"]
+    try:
+        nltk_sent_tokenize("nltk. punkt")
+    except (ImportError, LookupError) as e:
+        print(f"nltk sentence splitter unavailable ({type(e).__name__}), skipped")
+        splitters = ["simple"]
+
+    n_mismatches = 0
+    outputs = {}
+    for splitter in splitters:
+        print(f"Fast mode vs step by step, {splitter} splitter:")
+        expected = WrittenQueryProcessor(
+            sentence_splitter=splitter
+        ).processing_pipeline(sents)
+        outputs[splitter] = WrittenQueryProcessor(
+            fast=True, sentence_splitter=splitter
+        ).processing_pipeline(sents)
+        mismatches = print_mismatches(sents, expected, outputs[splitter])
+        n_mismatches += mismatches
+        print(f"{len(sents) - mismatches}/{len(sents)} identical outputs")
+
+    # The preprocessed queries of the datasets were made with the nltk splitter,
+    # with one sentence per " | " separated segment
+    print("Simple splitter vs preprocessed queries of queries.csv (nltk):")
+    mismatches = print_mismatches(
+        sents,
+        preprocessed,
+        [result.replace("\n", " | ") for result in outputs["simple"]],
+    )
+    print(f"{len(sents) - mismatches}/{len(sents)} identical outputs")
+    if "nltk" in outputs:
+        print("Simple splitter vs nltk splitter:")
+        mismatches = print_mismatches(sents, outputs["nltk"], outputs["simple"])
+        print(f"{len(sents) - mismatches}/{len(sents)} identical outputs")
+
+    for splitter in splitters:
+        for fast in [False, True]:
+            processor = WrittenQueryProcessor(fast=fast, sentence_splitter=splitter)
+            print(
+                f"{'fast' if fast else 'step by step'}, {splitter} splitter: "
+                f"{throughput(processor, sents, args.repeat):.0f} queries/s"
+            )
+    if n_mismatches:
+        sys.exit(1)
@@ -0,0 +1,218 @@
+"""
+Read and write BIO files (one "token<TAB>tag" line per token, sentences
+ended by an empty line) with a columnar in-memory representation
+
+BioCorpus stores the tokens of all the sentences in a flat list, their tags
+as ids in a numpy array, and the boundaries of the sentences in an offset
+array, which avoids a tuple per token and a list per sentence. Sentences are
+identified by their position in the file, duplicates included, and can be
+looked up by text through a secondary index built on first use. iter_bio reads
+sentences one at a time without loading the whole file. As in
+ds_utils.read_sents, tokens after the last empty line are ignored.
+"""
+
+import gc
+from contextlib import contextmanager
+from itertools import repeat
+
+import numpy as np
+
+# Size of the write buffer of write_bio and BioCorpus.save
+WRITE_BUFFER_SIZE = 1 << 20
+
+
+def _parse_line(line):
+    token, tag = line.split("\t")
+    return token, tag
+
+
+def _bio_block(pairs):
+    """
+    Lines of a sentence, followed by an empty line
+    """
+    block = "\n".join(map("\t".join, pairs))
+    return block + "\n\n" if block else "\n"
+
+
+@contextmanager
+def _gc_paused():
+    """
+    Pause the cyclic garbage collector, which would otherwise run many times
+    while millions of tuples (without reference cycles) are created
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+class BioCorpus:
+    """
+    Sentences of a BIO file in columnar form
+
+    :param tokens: tokens of all sentences, one after the other
+    :param tag_ids: id in tag_names of the tag of each token
+    :param tag_names: tag names indexed by id
+    :param offsets: sentence i spans tokens[offsets[i] : offsets[i + 1]]
+    """
+
+    def __init__(self, tokens, tag_ids, tag_names, offsets):
+        self.tokens = tokens
+        self.tag_ids = tag_ids
+        self.tag_names = tag_names
+        self.offsets = offsets
+        self._text_index = None
+
+    @classmethod
+    def from_lists(cls, sents):
+        """
+        Build a corpus from sentences given as lists of (token, tag) pairs
+        """
+        tokens = []
+        tags = []
+        offsets = [0]
+        for sent in sents:
+            for token, tag in sent:
+                tokens.append(token)
+                tags.append(tag)
+            offsets.append(len(tokens))
+        return cls._from_columns(tokens, tags, offsets)
+
+    @classmethod
+    def read(cls, bio_file):
+        """
+        Parse a BIO file
+        """
+        with open(bio_file, "r") as _:
+            lines = _.read().split("\n")
+        # The newline ending the last line does not start a new line
+        if lines[-1] == "":
+            lines.pop()
+
+        # The k-th empty line, at index i, ends a sentence after i - k tokens
+        empty = np.flatnonzero(np.fromiter(map(len, lines), np.int64, len(lines)) == 0)
+        ends = empty - np.arange(len(empty))
+        n_tokens = int(ends[-1]) if len(ends) else 0
+
+        token_lines = [line for line in lines if line][:n_tokens]
+        n_tabs = np.fromiter(map(str.count, token_lines, repeat("\t")), np.int64)
+        if (n_tabs != 1).any():
+            # Raise the error of the first line without exactly one tab
+            _parse_line(token_lines[np.flatnonzero(n_tabs != 1)[0]])
+        fields = "\t".join(token_lines).split("\t")
+        return cls._from_columns(
+            fields[0::2], fields[1::2], np.concatenate([[0], ends])
+        )
+
+    @classmethod
+    def _from_columns(cls, tokens, tags, offsets):
+        tag_names = list(dict.fromkeys(tags))
+        tag_index = {tag: i for i, tag in enumerate(tag_names)}
+        tag_ids = np.fromiter(map(tag_index.__getitem__, tags), np.int32, len(tags))
+        return cls(tokens, tag_ids, tag_names, np.asarray(offsets, dtype=np.int64))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def sentence(self, i):
+        """
+        Tokens and tags of the i-th sentence
+        """
+        start, end = self.offsets[i], self.offsets[i + 1]
+        tags = list(map(self.tag_names.__getitem__, self.tag_ids[start:end].tolist()))
+        return self.tokens[start:end], tags
+
+    def text(self, i):
+        """
+        Text of the i-th sentence, its tokens joined by spaces
+        """
+        return " ".join(self.tokens[self.offsets[i] : self.offsets[i + 1]])
+
+    def ids(self, text):
+        """
+        Ids of the sentences with this text, in order
+        """
+        if self._text_index is None:
+            offsets = self.offsets.tolist()
+            self._text_index = {}
+            for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+                self._text_index.setdefault(
+                    " ".join(self.tokens[start:end]), []
+                ).append(i)
+        return self._text_index.get(text, [])
+
+    def tag_lists(self):
+        """
+        Tags of each sentence, in order
+        """
+        return [tags for _, tags in self]
+
+    def pairs(self):
+        """
+        Iterate over the sentences as lists of (token, tag) pairs
+        """
+        for tokens, tags in self:
+            yield list(zip(tokens, tags))
+
+    def __iter__(self):
+        tags = list(map(self.tag_names.__getitem__, self.tag_ids.tolist()))
+        offsets = self.offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield self.tokens[start:end], tags[start:end]
+
+    def to_dict(self):
+        """
+        Sentences in the format of ds_utils.read_sents: dictionary with the
+        sentence's text as key and the list of (token, tag) pairs as value
+        """
+        offsets = self.offsets.tolist()
+        with _gc_paused():
+            pairs = list(
+                zip(self.tokens, map(self.tag_names.__getitem__, self.tag_ids.tolist()))
+            )
+            return {
+                " ".join(self.tokens[start:end]): pairs[start:end]
+                for start, end in zip(offsets[:-1], offsets[1:])
+            }
+
+    def save(self, bio_file):
+        """
+        Write the sentences in a BIO file
+        """
+        tags = map(self.tag_names.__getitem__, self.tag_ids.tolist())
+        lines = list(map("\t".join, zip(self.tokens, tags)))
+        offsets = self.offsets.tolist()
+        with open(bio_file, "w", buffering=WRITE_BUFFER_SIZE) as _:
+            for start, end in zip(offsets[:-1], offsets[1:]):
+                _.write("\n".join(lines[start:end]) + "\n\n" if end > start else "\n")
+
+
+def iter_bio(bio_file):
+    """
+    Lazily read a BIO file, yielding the tokens and the tags of each sentence
+    """
+    tokens = []
+    tags = []
+    with open(bio_file, "r") as _:
+        for line in _:
+            line = line.rstrip("\n")
+            if line == "":
+                yield tokens, tags
+                tokens = []
+                tags = []
+            else:
+                token, tag = _parse_line(line)
+                tokens.append(token)
+                tags.append(tag)
+
+
+def write_bio(sents, bio_file):
+    """
+    Write sentences given as iterables of (token, tag) pairs in a BIO file,
+    through a large write buffer
+    """
+    with open(bio_file, "w", buffering=WRITE_BUFFER_SIZE) as _:
+        _.writelines(map(_bio_block, sents))
@@ -2,9 +2,107 @@ import argparse
 import os
 import shutil
 import sys
+from collections import Counter
 
 import ds_utils as dsu
+import numpy as np
 import pandas as pd
+from bio_io import BioCorpus
+from entity_inventory import load_inventory
+from entity_matcher import EntityMatcher
+from tabulate import tabulate
+
+
+def query_mentions(df):
+    """
+    Group linked entities by query
+    Return a dictionary with the query as key and the list of its mentions,
+    in the order of the rows, as value
+    """
+    return df.groupby("query", sort=False)["mention"].agg(list).to_dict()
+
+
+def update_kept_ents(masker, kept_ents, rows, step):
+    """
+    Add (step 1) or remove (step -1) linked entities from the entities kept
+    per query, and mask again the queries whose entities changed
+    masker: EntityMasker of the test set
+    kept_ents: dict with query as key and Counter of its kept mentions as value
+    rows: (query, mention) tuples of the linked entities
+    Return the number of queries masked again
+    """
+    changed = set()
+    for (query, mention), count in Counter(rows).items():
+        mentions = kept_ents.setdefault(query, Counter())
+        mentions[mention] += step * count
+        if not mentions[mention]:
+            del mentions[mention]
+        if not mentions:
+            del kept_ents[query]
+        changed.add(query)
+    for query in changed:
+        masker.update(query, list(kept_ents.get(query, ())))
+    return len(changed)
+
+
+def sweep(sents, matcher, seen_df, rare_unseen_df, thresholds, train_fpath, sweep_dir):
+    """
+    Write the seen and rare / unseen test sets of several exposure thresholds
+    in sweep_dir/th_<threshold>/seen and sweep_dir/th_<threshold>/rare_unseen
+    The thresholds are processed in increasing order: the seen entities
+    (exposure > threshold) are removed and the rare linked entities (exposure
+    <= threshold) added by increasing exposure, and only the queries whose
+    entities changed since the previous threshold are masked again
+    seen_df: linked entities, those of train having the highest exposure
+    rare_unseen_df: linked entities neither in train nor seen by humans
+    Return a row of statistics per threshold
+    """
+    seen_df = seen_df.sort_values("exposure", kind="stable")
+    seen_exposure = seen_df["exposure"].to_numpy()
+    seen_rows = list(zip(seen_df["query"].tolist(), seen_df["mention"].tolist()))
+    linked_df = rare_unseen_df[rare_unseen_df.wiki_name != ""].sort_values(
+        "exposure", kind="stable"
+    )
+    rare_exposure = linked_df["exposure"].to_numpy()
+    rare_rows = list(zip(linked_df["query"].tolist(), linked_df["mention"].tolist()))
+    unlinked_df = rare_unseen_df[rare_unseen_df.wiki_name == ""]
+    unlinked_rows = zip(unlinked_df["query"].tolist(), unlinked_df["mention"].tolist())
+
+    # all entities are seen below the lowest exposure, only the unlinked ones
+    # are rare / unseen
+    seen = {}
+    seen_masker = dsu.EntityMasker(sents, matcher)
+    update_kept_ents(seen_masker, seen, seen_rows, 1)
+    rare_unseen = {}
+    rare_unseen_masker = dsu.EntityMasker(sents, matcher)
+    update_kept_ents(rare_unseen_masker, rare_unseen, unlinked_rows, 1)
+
+    results = []
+    n_seen_removed = 0
+    n_rare_added = 0
+    for threshold in sorted(set(thresholds)):
+        k = int(np.searchsorted(seen_exposure, threshold, side="right"))
+        n_masked = update_kept_ents(seen_masker, seen, seen_rows[n_seen_removed:k], -1)
+        n_seen_removed = k
+        k = int(np.searchsorted(rare_exposure, threshold, side="right"))
+        n_masked += update_kept_ents(
+            rare_unseen_masker, rare_unseen, rare_rows[n_rare_added:k], 1
+        )
+        n_rare_added = k
+
+        th_dir = os.path.join(sweep_dir, f"th_{threshold:g}")
+        for name, masker in [
+            ("seen", seen_masker),
+            ("rare_unseen", rare_unseen_masker),
+        ]:
+            out_dir = os.path.join(th_dir, name)
+            if not os.path.exists(out_dir):
+                os.makedirs(out_dir)
+            shutil.copyfile(train_fpath, os.path.join(out_dir, "train.bio"))
+            masker.masked().save(os.path.join(out_dir, "test.bio"))
+        results.append([threshold, len(seen), len(rare_unseen), n_masked])
+    return results
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -17,7 +115,6 @@ if __name__ == "__main__":
         type=int,
         default=1,
         help="Threshold for seen entities",
-        required=True,
     )
     parser.add_argument(
         "--th_rare_unseen",
@@ -25,7 +122,23 @@ if __name__ == "__main__":
         type=int,
         default=0,
         help="Threshold for rare or unseen entities",
-        required=True,
+    )
+    parser.add_argument(
+        "--sweep_thresholds",
+        dest="sweep_thresholds",
+        type=float,
+        nargs="+",
+        default=None,
+        help="Exposure thresholds of a sweep: the seen and rare / unseen test "
+        "sets of each threshold are written in th_<threshold> subdirectories of "
+        "--sweep_dir, instead of those of --th_seen and --th_rare_unseen",
+    )
+    parser.add_argument(
+        "--sweep_dir",
+        dest="sweep_dir",
+        type=str,
+        default=None,
+        help="Output directory of the sweep, <data_dir>/sweep if not set",
     )
     args = parser.parse_args()
     data_dir = args.data_dir
@@ -35,20 +148,6 @@ if __name__ == "__main__":
         print("{} file not found".format(data_fpath))
         sys.exit(1)
 
-    # create output folder for seen entities
-    out_dir_seen = data_dir + "/seen"
-    if not os.path.exists(out_dir_seen):
-        os.makedirs(out_dir_seen)
-    # copy the training data
-    shutil.copyfile(data_fpath, os.path.join(out_dir_seen, "train.bio"))
-
-    # create output folder for unseen entities
-    out_dir_rare_unseen = data_dir + "/rare_unseen"
-    if not os.path.exists(out_dir_rare_unseen):
-        os.makedirs(out_dir_rare_unseen)
-    # copy the training data
-    shutil.copyfile(data_fpath, os.path.join(out_dir_rare_unseen, "train.bio"))
-
     # read the csv containing the linked entities and their exposure
     ents_fpath = os.path.join(data_dir, "ground-truth_linked.csv")
     if not os.path.isfile(ents_fpath):
@@ -56,64 +155,91 @@ if __name__ == "__main__":
         sys.exit(1)
     df = pd.read_csv(ents_fpath)
     df.fillna("", inplace=True)
+    # matcher of all the linked mentions, used to mask both test sets
+    matcher = EntityMatcher(df["mention"].unique())
 
     # read the original test file that will be changed
     test_fpath = os.path.join(data_dir, "test.bio")
     if not os.path.isfile(test_fpath):
         print("{} file not found".format(test_fpath))
         sys.exit(1)
-    sents = dsu.read_sents(test_fpath)
+    # sentences are kept by position, duplicated queries included
+    sents = BioCorpus.read(test_fpath)
+
+    # entities of train and test and entities known by humans, computed once
+    # per data directory
+    inventory = load_inventory(data_dir)
 
     # artificially change the exposure to max for all entities
     # that are found in the train set
-    train_sents = dsu.read_sents(data_fpath)
-    train_ents = dsu.entities(train_sents.values())
-    test_ents = dsu.entities(sents.values())
-    test_ents_all = set(test_ents["Artist"] + test_ents["WoA"])
-    common_ents = set()
-    for etype in train_ents:
-        common_ents.update(set(train_ents[etype]).intersection(set(test_ents[etype])))
+    common_ents = inventory.common_entities("train", "test")
     df.loc[df.mention.isin(common_ents), "exposure"] = df["exposure"].max() + 1
 
     # find all entities seen by humans in order to remove those from unseen
-    seen_humans = dsu.get_ents_seen_by_humans(data_dir)
+    seen_humans = inventory.human_known_entities()
+
+    if args.sweep_thresholds is not None:
+        sweep_dir = args.sweep_dir or os.path.join(data_dir, "sweep")
+        results = sweep(
+            sents,
+            matcher,
+            df,
+            df[~df.mention.isin(common_ents | seen_humans)],
+            args.sweep_thresholds,
+            data_fpath,
+            sweep_dir,
+        )
+        print(f"Test sets written in {sweep_dir}")
+        print(
+            tabulate(
+                results,
+                headers=[
+                    "Threshold",
+                    "Queries with seen entities",
+                    "Queries with rare unseen entities",
+                    "Queries masked again",
+                ],
+            )
+        )
+        sys.exit(0)
+
+    # create output folder for seen entities
+    out_dir_seen = data_dir + "/seen"
+    if not os.path.exists(out_dir_seen):
+        os.makedirs(out_dir_seen)
+    # copy the training data
+    shutil.copyfile(data_fpath, os.path.join(out_dir_seen, "train.bio"))
+
+    # create output folder for unseen entities
+    out_dir_rare_unseen = data_dir + "/rare_unseen"
+    if not os.path.exists(out_dir_rare_unseen):
+        os.makedirs(out_dir_rare_unseen)
+    # copy the training data
+    shutil.copyfile(data_fpath, os.path.join(out_dir_rare_unseen, "train.bio"))
 
     # consider the entities seen during pre-training (exposure > threshold)
-    seen = {}
-    tuples = df[df.exposure > args.th_seen][["query", "mention"]].itertuples(
-        index=False
-    )
-    for query, ent in tuples:
-        if query not in seen:
-            seen[query] = []
-        seen[query].append(ent)
+    seen = query_mentions(df[df.exposure > args.th_seen])
     print(
         "Seen - Number of unique queries with entities before masking ",
-        len(set(df["query"].to_list())),
+        df["query"].nunique(),
     )
     # mask entities not among the queries in seen (their tag becomes "O")
-    seen_sents = dsu.mask_ents(sents, seen)
+    seen_sents = dsu.mask_ents(sents, seen, matcher)
     print("Number of queries with seen entities", len(seen))
-    dsu.save_sents(seen_sents, os.path.join(out_dir_seen, "test.bio"))
+    seen_sents.save(os.path.join(out_dir_seen, "test.bio"))
 
-    # consider the entities seen during pre-training (exposure > threshold)
-    rare_unseen = {}
     common_ents.update(seen_humans)
     # remove from the dataset all entities seen either by model during fine-tuning or acknowledged seen by humans
     df = df[~df.mention.isin(common_ents)]
     print(
         "Rare / Unseen - Number of unique queries with entities before masking ",
-        len(set(df["query"].to_list())),
+        df["query"].nunique(),
     )
     # unseen or rare entities are those which could not be linked or which were linked but rare
     df = df[(df.wiki_name == "") | (df.exposure <= args.th_rare_unseen)]
-    tuples = df[["query", "mention"]].itertuples(index=False)
-    for query, ent in tuples:
-        if query not in rare_unseen:
-            rare_unseen[query] = []
-        rare_unseen[query].append(ent)
+    rare_unseen = query_mentions(df)
     print("Number of unique queries with rare unseen entities ", len(rare_unseen))
     # print(df['query'].unique())
     # mask entities not among the queries in rare_unseen (their tag becomes "O")
-    rare_unseen_sents = dsu.mask_ents(sents, rare_unseen)
-    dsu.save_sents(rare_unseen_sents, os.path.join(out_dir_rare_unseen, "test.bio"))
+    rare_unseen_sents = dsu.mask_ents(sents, rare_unseen, matcher)
+    rare_unseen_sents.save(os.path.join(out_dir_rare_unseen, "test.bio"))
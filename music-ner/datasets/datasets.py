@@ -11,31 +11,93 @@ import os
 import re
 
 import datasets
+import numpy as np
+import pyarrow as pa
 
 logger = datasets.logging.get_logger(__name__)
 
 _DESCRIPTION = """MusicRecoNER dataset loader containing noisy / unformatted queries for music recommendation with annotated Artist and WoA entities"""
 _DATA_FILE = "train.bio"
 _TEST_FILE = "test.bio"
+_NER_TAGS = ["O", "B-Artist", "I-Artist", "B-WoA", "I-WoA"]
+# Subsets created by create_seen_rare_ds.py in subdirectories of a dataset
+_SUBSETS = ["seen", "rare_unseen"]
+# Number of examples per Arrow table written by the builder
+_BATCH_SIZE = 10000
+
+
+def _split_line(line):
+    """
+    Token and tag of a line, tokens and tags being separated by whitespace
+    """
+    splits = re.split(r"\s+", line)
+    return splits[0].strip(), splits[1].rstrip()
+
+
+def _parse_bio(text, tag_ids):
+    """
+    Parse the content of a BIO file in bulk
+    As the line by line parsing of the original loader, empty sentences are
+    skipped, apart from the last one: the tokens after the last empty line
+    always make an example, empty when the file ends with an empty line
+    Return the tokens, the tag ids and the offsets of the examples (example i
+    spans tokens[offsets[i] : offsets[i + 1]])
+    """
+    lines = text.split("\n")
+    # The newline ending the last line does not start a new line
+    if lines[-1] == "":
+        lines.pop()
+    token_lines = [line for line in lines if line]
+
+    # The k-th empty line, at index i, ends a sentence after i - k tokens
+    empty = np.flatnonzero(np.fromiter(map(len, lines), np.int64, len(lines)) == 0)
+    ends = empty - np.arange(len(empty))
+    offsets = np.concatenate([[0], np.unique(ends[ends > 0]), [len(token_lines)]])
+
+    # Lines are "token\ttag": split them all at once, and fall back to the line
+    # by line parsing if a line does not have exactly one tab, a token has
+    # whitespace or a tag is unknown
+    fields = "\t".join(token_lines).split("\t")
+    tokens = fields[0::2]
+    tags = fields[1::2]
+    joined_tokens = "".join(tokens)
+    if (
+        len(fields) != 2 * len(token_lines)
+        or (joined_tokens and joined_tokens.split() != [joined_tokens])
+        or not set(tags) <= tag_ids.keys()
+    ):
+        tokens, tags = zip(*map(_split_line, token_lines)) if token_lines else ((), ())
+    try:
+        tags = np.fromiter(map(tag_ids.__getitem__, tags), np.int64, len(tags))
+    except KeyError as e:
+        raise ValueError(f"Unknown tag {e}") from e
+    return list(tokens), tags, offsets
 
 
 class MusicNERConfig(datasets.BuilderConfig):
-    """BuilderConfig for Conll2003"""
+    """BuilderConfig for MusicNER"""
 
-    def __init__(self, **kwargs):
-        """BuilderConfig forConll2003.
+    def __init__(self, subset=None, **kwargs):
+        """BuilderConfig for MusicNER.
         Args:
+          subset: subdirectory of the data directory whose files are loaded
+            (seen or rare_unseen), the data directory itself if None.
           **kwargs: keyword arguments forwarded to super.
         """
         super(MusicNERConfig, self).__init__(**kwargs)
+        self.subset = subset
 
 
-class MusicNER(datasets.GeneratorBasedBuilder):
+class MusicNER(datasets.ArrowBasedBuilder):
     """MusicNER dataset."""
 
     BUILDER_CONFIGS = [
         MusicNERConfig(name="music-reco-ner", version=datasets.Version("1.0.0"))
+    ] + [
+        MusicNERConfig(name=subset, subset=subset, version=datasets.Version("1.0.0"))
+        for subset in _SUBSETS
     ]
+    DEFAULT_CONFIG_NAME = "music-reco-ner"
 
     def _info(self):
         return datasets.DatasetInfo(
@@ -45,15 +107,7 @@ class MusicNER(datasets.GeneratorBasedBuilder):
                     "id": datasets.Value("string"),
                     "tokens": datasets.Sequence(datasets.Value("string")),
                     "ner_tags": datasets.Sequence(
-                        datasets.features.ClassLabel(
-                            names=[
-                                "O",
-                                "B-Artist",
-                                "I-Artist",
-                                "B-WoA",
-                                "I-WoA",
-                            ]
-                        )
+                        datasets.features.ClassLabel(names=_NER_TAGS)
                     ),
                 }
             ),
@@ -63,11 +117,13 @@ class MusicNER(datasets.GeneratorBasedBuilder):
     def _split_generators(self, dl_manager):
         """Returns SplitGenerators."""
         data_dir = dl_manager._data_dir
+        if self.config.subset is not None:
+            data_dir = os.path.join(data_dir, self.config.subset)
         data_files = {
             "data": os.path.join(data_dir, _DATA_FILE),
             "test": os.path.join(data_dir, _TEST_FILE),
         }
-        return [
+        split_generators = [
             datasets.SplitGenerator(
                 name=datasets.Split.TRAIN, gen_kwargs={"filepath": data_files["data"]}
             ),
@@ -75,32 +131,33 @@ class MusicNER(datasets.GeneratorBasedBuilder):
                 name=datasets.Split.TEST, gen_kwargs={"filepath": data_files["test"]}
             ),
         ]
+        # The default config also exposes the test sets of the subsets, so that
+        # one load serves all the scenarios
+        if self.config.subset is None:
+            for subset in _SUBSETS:
+                test_file = os.path.join(data_dir, subset, _TEST_FILE)
+                if os.path.isfile(test_file):
+                    split_generators.append(
+                        datasets.SplitGenerator(
+                            name=f"test_{subset}", gen_kwargs={"filepath": test_file}
+                        )
+                    )
+        return split_generators
 
-    def _generate_examples(self, filepath):
+    def _generate_tables(self, filepath):
         logger.info("⏳ Generating examples from = %s", filepath)
         with open(filepath, encoding="utf-8") as f:
-            guid = 0
-            tokens = []
-            ner_tags = []
-            for line in f:
-                if line == "" or line == "\n":
-                    if tokens:
-                        yield guid, {
-                            "id": str(guid),
-                            "tokens": tokens,
-                            "ner_tags": ner_tags,
-                        }
-                        guid += 1
-                        tokens = []
-                        ner_tags = []
-                else:
-                    # tokens are \t separated
-                    splits = re.split(r"\s+", line)
-                    tokens.append(splits[0].strip())
-                    ner_tags.append(splits[1].rstrip())
-            # last example
-            yield guid, {
-                "id": str(guid),
-                "tokens": tokens,
-                "ner_tags": ner_tags,
-            }
+            tokens, tags, offsets = _parse_bio(
+                f.read(), {tag: i for i, tag in enumerate(_NER_TAGS)}
+            )
+        offsets = pa.array(offsets, pa.int32())
+        table = pa.Table.from_arrays(
+            [
+                pa.array(map(str, range(len(offsets) - 1)), pa.string()),
+                pa.ListArray.from_arrays(offsets, pa.array(tokens, pa.string())),
+                pa.ListArray.from_arrays(offsets, pa.array(tags, pa.int64())),
+            ],
+            schema=self.info.features.arrow_schema,
+        )
+        for i, batch in enumerate(table.to_batches(max_chunksize=_BATCH_SIZE)):
+            yield i, pa.Table.from_batches([batch])
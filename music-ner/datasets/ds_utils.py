@@ -1,4 +1,20 @@
+import hashlib
+
+import numpy as np
 import pandas as pd
+from bio_io import BioCorpus, write_bio
+from entity_matcher import EntityMatcher
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    SHA-256 of the content of a file
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as _:
+        for chunk in iter(lambda: _.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
 
 
 def read_sents(bio_file):
@@ -7,30 +23,14 @@ def read_sents(bio_file):
     Return sentences as a dictionary with sentence's text as key
     and (token, tag) pairs as value
     """
-    sents = {}
-    with open(bio_file, "r") as _:
-        lines = [line.replace("\n", "") for line in _.readlines()]
-        sent = []
-        for line in lines:
-            if line == "":
-                key = " ".join([t[0] for t in sent])
-                sents[key] = sent
-                sent = []
-            else:
-                token, tag = line.split("\t")
-                sent.append((token, tag))
-    return sents
+    return BioCorpus.read(bio_file).to_dict()
 
 
 def save_sents(sents, bio_file):
     """
     Save sentences (lists of (token, tag) pairs) in a BIO file
     """
-    with open(bio_file, "w") as _:
-        for sent in sents.values():
-            for token_tag in sent:
-                _.write("\t".join(token_tag) + "\n")
-            _.write("\n")
+    write_bio(sents.values(), bio_file)
 
 
 def entities(sents):
@@ -63,70 +63,72 @@ def entities(sents):
     return ents
 
 
-def mask_ents(sents, keep_ents):
+class EntityMasker:
     """
-    Change tags to O for all entities apart from those in keep_ents
-    keep_ents: dict with sentence's text as key and entities as values
-    sents: dict with sentence's text as key and (token, tag) pairs as value
-    Return a new dictionary of sentences with the updated tags
+    Tags of a corpus where all entities are masked (tagged O) apart from
+    those kept, updated query by query, so that masks differing by a few
+    queries are computed without masking the whole corpus again
+    corpus: BioCorpus of the sentences, all the sentences with the same text
+    being masked alike
+    matcher: EntityMatcher built from (at least) all the kept entities
     """
-    new_sents = {}
-    for sent in sents:
-        new_sents[sent] = []
-        # print('before', sents[sent])
-        if sent in keep_ents:
-            sent_words = sent.split()
-            ents = keep_ents[sent]
-            no_change_indices = set()
-            # print(ents)
-            for ent in ents:
-                ent_words = ent.split()
-                indices = find_indices(ent_words, sent_words)
-                for start, stop in indices:
-                    if start == -1:
-                        print("Issue with entity ", ent)
-                        continue
-                    else:
-                        for i in range(start, stop):
-                            no_change_indices.add(i)
-            for i in range(len(sents[sent])):
-                if i in no_change_indices:
-                    new_sents[sent].append(sents[sent][i])
-                else:
-                    new_sents[sent].append((sents[sent][i][0], "O"))
-        else:
-            for i in range(len(sents[sent])):
-                new_sents[sent].append((sents[sent][i][0], "O"))
-        # print('after', new_sents[sent])
-        # print('\n')
-    return new_sents
-
-
-def find_indices(ent_words, sent_words):
+
+    def __init__(self, corpus, matcher):
+        self.corpus = corpus
+        self.matcher = matcher
+        self.tag_names = list(corpus.tag_names)
+        if "O" not in self.tag_names:
+            self.tag_names.append("O")
+        self.o_id = self.tag_names.index("O")
+        self.tag_ids = np.full_like(corpus.tag_ids, self.o_id)
+
+    def update(self, sent, ents):
+        """
+        Keep the tags of the entities ents, and only those, in the sentences
+        with text sent
+        """
+        ids = self.corpus.ids(sent)
+        if not ids:
+            return
+        sent_words = sent.split()
+        keep = np.zeros(len(sent_words), dtype=bool)
+        for start, stop in self.matcher.spans(sent_words, ents):
+            keep[start:stop] = True
+        kept = np.flatnonzero(keep)
+        offsets = self.corpus.offsets
+        for i in ids:
+            self.tag_ids[offsets[i] : offsets[i + 1]] = self.o_id
+            token_ids = offsets[i] + kept
+            self.tag_ids[token_ids] = self.corpus.tag_ids[token_ids]
+
+    def masked(self):
+        """
+        Return a new BioCorpus with the current tags
+        """
+        return BioCorpus(
+            self.corpus.tokens,
+            self.tag_ids.copy(),
+            self.tag_names,
+            self.corpus.offsets,
+        )
+
+
+def mask_ents(corpus, keep_ents, matcher=None):
     """
-    Find the start and end indices of an entity in a sentence
-    The entity and sentence are given as word lists,
-    but the function works directly on strings too
+    Change tags to O for all entities apart from those in keep_ents
+    keep_ents: dict with sentence's text as key and entities as values
+    corpus: BioCorpus of the sentences, all the sentences with the same text
+    being masked alike
+    matcher: EntityMatcher built from (at least) all the entities of
+    keep_ents, built from keep_ents if not given
+    Return a new BioCorpus with the updated tags
     """
-    indices = []
-    start_index = -1
-    stop_index = 0
-    for i in range(len(sent_words)):
-        if stop_index == len(ent_words):
-            # found an occurence, add it to the list
-            indices.append((start_index, start_index + len(ent_words)))
-            # reset stop index
-            stop_index = 0
-        if sent_words[i] == ent_words[stop_index]:
-            if stop_index == 0:
-                start_index = i
-            stop_index += 1
-        else:
-            stop_index = 0
-    # check if there is one final occurence not saved
-    if stop_index == len(ent_words):
-        indices.append((start_index, start_index + len(ent_words)))
-    return indices
+    if matcher is None:
+        matcher = EntityMatcher(ent for ents in keep_ents.values() for ent in ents)
+    masker = EntityMasker(corpus, matcher)
+    for sent, ents in keep_ents.items():
+        masker.update(sent, ents)
+    return masker.masked()
 
 
 def get_ents_seen_by_humans(data_dir):
@@ -136,9 +138,16 @@ def get_ents_seen_by_humans(data_dir):
     seen_ents = set()
     for i in range(1, 4):
         f = f"{data_dir}/annotator{i}.csv"
-        adf = pd.read_csv(f, index_col=None)
+        adf = pd.read_csv(f, usecols=["text", "start_offset", "end_offset", "label"])
         adf = adf[adf.label.isin(["Artist_known", "WoA_known"])]
-        for r in adf.to_records():
-            entity = r[2][r[3] : r[4]]
-            seen_ents.add(entity)
+        # slice each distinct annotation once
+        adf = adf.drop_duplicates(["text", "start_offset", "end_offset"])
+        seen_ents.update(
+            text[start:end]
+            for text, start, end in zip(
+                adf["text"].tolist(),
+                adf["start_offset"].tolist(),
+                adf["end_offset"].tolist(),
+            )
+        )
     return seen_ents
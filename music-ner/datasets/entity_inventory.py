@@ -0,0 +1,303 @@
+"""
+Inventory of the entities of a dataset directory, built once and cached
+
+For each (entity, type) pair, the inventory holds its number of occurrences
+in train.bio and test.bio, its highest exposure in ground-truth_linked.csv
+(NaN if it is not in the file), whether it was linked to a Wikipedia page and
+whether an annotator declared it known. It is stored in data_dir as a
+compressed npz file of columns, with the mtimes, sizes and SHA-256 of the
+source files: load_inventory rebuilds it when a source file was added,
+removed or changed (a file only touched is recognized by its hash).
+
+create_seen_rare_ds.py and stats.py load the inventory instead of parsing
+the BIO and annotator files. Run this file to (re)build it.
+"""
+
+import argparse
+import json
+import logging
+import os
+import tempfile
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+from bio_io import BioCorpus
+from ds_utils import entities, file_digest, get_ents_seen_by_humans
+
+logger = logging.getLogger(__name__)
+
+INVENTORY_FILE = "entity_inventory.npz"
+# Change when the content of the inventory changes, to invalidate saved ones
+INVENTORY_VERSION = 1
+
+SPLITS = ["train", "test"]
+LINKED_FILE = "ground-truth_linked.csv"
+ANNOTATOR_FILES = [f"annotator{i}.csv" for i in range(1, 4)]
+
+
+def source_files(data_dir):
+    """
+    Files of data_dir the inventory is built from
+    """
+    names = [f"{split}.bio" for split in SPLITS] + [LINKED_FILE] + ANNOTATOR_FILES
+    return [name for name in names if os.path.isfile(os.path.join(data_dir, name))]
+
+
+def source_signature(path):
+    stat = os.stat(path)
+    return {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": file_digest(path),
+    }
+
+
+class EntityInventory:
+    """
+    Columns of the inventory, one row per (entity, type) pair
+
+    :param entities: entity strings
+    :param type_ids: id in type_names of the type of each entity
+    :param type_names: entity types indexed by id
+    :param counts: dict with the number of occurrences of each entity in each
+        split
+    :param exposure: highest exposure of each entity, NaN if not linked
+    :param linked: whether each entity was linked to a Wikipedia page
+    :param human_known: whether an annotator declared each entity known
+    :param meta: number of sentences per split, source file signatures, ...
+    """
+
+    def __init__(
+        self,
+        entities,
+        type_ids,
+        type_names,
+        counts,
+        exposure,
+        linked,
+        human_known,
+        meta,
+    ):
+        self.entities = entities
+        self.type_ids = type_ids
+        self.type_names = type_names
+        self.counts = counts
+        self.exposure = exposure
+        self.linked = linked
+        self.human_known = human_known
+        self.meta = meta
+
+    @classmethod
+    def build(cls, data_dir):
+        """
+        Build the inventory of the entities of a dataset directory
+        """
+        sources = source_files(data_dir)
+        meta = {
+            "version": INVENTORY_VERSION,
+            "sources": {
+                name: source_signature(os.path.join(data_dir, name)) for name in sources
+            },
+            "sentences": {},
+        }
+
+        # Rows in order of first occurrence, in train, then test, then the
+        # linked entities
+        split_counts = {}
+        rows = {}
+        test_texts = []
+        for split in SPLITS:
+            if f"{split}.bio" not in sources:
+                continue
+            corpus = BioCorpus.read(os.path.join(data_dir, f"{split}.bio"))
+            meta["sentences"][split] = len(corpus)
+            if split == "test":
+                test_texts = [corpus.text(i) for i in range(len(corpus))]
+            split_counts[split] = Counter()
+            for etype, ents in entities(corpus.pairs()).items():
+                for entity in ents:
+                    rows.setdefault((entity, etype), len(rows))
+                    split_counts[split][(entity, etype)] += 1
+
+        exposure = {}
+        linked = set()
+        if LINKED_FILE in sources:
+            df = pd.read_csv(os.path.join(data_dir, LINKED_FILE))
+            df.fillna("", inplace=True)
+            for mention, etype, wiki_name, value in df[
+                ["mention", "type", "wiki_name", "exposure"]
+            ].itertuples(index=False):
+                rows.setdefault((mention, etype), len(rows))
+                exposure[(mention, etype)] = max(
+                    value, exposure.get((mention, etype), -np.inf)
+                )
+                if wiki_name != "":
+                    linked.add((mention, etype))
+            queries = set(df["query"])
+            meta["unlinked_test_sentences"] = sum(
+                text not in queries for text in test_texts
+            )
+
+        human_known = set()
+        if all(name in sources for name in ANNOTATOR_FILES):
+            human_known = get_ents_seen_by_humans(data_dir)
+
+        keys = list(rows)
+        type_names = list(dict.fromkeys(etype for _, etype in keys))
+        type_index = {etype: i for i, etype in enumerate(type_names)}
+        return cls(
+            [entity for entity, _ in keys],
+            np.array([type_index[etype] for _, etype in keys], dtype=np.int32),
+            type_names,
+            {
+                split: np.array([counts[key] for key in keys], dtype=np.int32)
+                for split, counts in split_counts.items()
+            },
+            np.array([exposure.get(key, np.nan) for key in keys], dtype=np.float64),
+            np.array([key in linked for key in keys], dtype=bool),
+            np.array([entity in human_known for entity, _ in keys], dtype=bool),
+            meta,
+        )
+
+    def save(self, path):
+        """
+        Save the inventory in a npz file, written in a temporary file then
+        renamed so that readers never see a partial file
+        """
+        meta = dict(self.meta, type_names=self.type_names)
+        arrays = {f"count_{split}": counts for split, counts in self.counts.items()}
+        tmp_fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix=".npz"
+        )
+        with os.fdopen(tmp_fd, "wb") as f:
+            np.savez_compressed(
+                f,
+                meta=np.array(json.dumps(meta)),
+                # Entities do not contain newlines
+                entities=np.frombuffer("\n".join(self.entities).encode(), np.uint8),
+                type_ids=self.type_ids,
+                exposure=self.exposure,
+                linked=self.linked,
+                human_known=self.human_known,
+                **arrays,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as f:
+            meta = json.loads(str(f["meta"]))
+            type_names = meta.pop("type_names")
+            ents = f["entities"].tobytes().decode().split("\n")
+            if not len(f["type_ids"]):
+                ents = []
+            return cls(
+                ents,
+                f["type_ids"],
+                type_names,
+                {
+                    name[len("count_") :]: f[name]
+                    for name in f.files
+                    if name.startswith("count_")
+                },
+                f["exposure"],
+                f["linked"],
+                f["human_known"],
+                meta,
+            )
+
+    def is_fresh(self, data_dir):
+        """
+        Whether the inventory was built from the current files of data_dir
+        """
+        if self.meta.get("version") != INVENTORY_VERSION:
+            return False
+        sources = self.meta["sources"]
+        if set(sources) != set(source_files(data_dir)):
+            return False
+        for name, signature in sources.items():
+            path = os.path.join(data_dir, name)
+            stat = os.stat(path)
+            if (stat.st_mtime_ns, stat.st_size) == (
+                signature["mtime_ns"],
+                signature["size"],
+            ):
+                continue
+            if stat.st_size != signature["size"]:
+                return False
+            if file_digest(path) != signature["sha256"]:
+                return False
+        return True
+
+    def __len__(self):
+        return len(self.entities)
+
+    def split_entities(self, split):
+        """
+        Entities of a split grouped by type, with their number of occurrences
+        """
+        ents = {}
+        for entity, type_id, count in zip(
+            self.entities, self.type_ids.tolist(), self.counts[split].tolist()
+        ):
+            if count:
+                ents.setdefault(self.type_names[type_id], {})[entity] = count
+        return ents
+
+    def common_entities(self, split1="train", split2="test"):
+        """
+        Entities occurring with the same type in both splits
+        """
+        both = (self.counts[split1] > 0) & (self.counts[split2] > 0)
+        return {self.entities[i] for i in np.flatnonzero(both)}
+
+    def human_known_entities(self):
+        """
+        Entities declared known by at least one annotator
+        """
+        return {self.entities[i] for i in np.flatnonzero(self.human_known)}
+
+
+def load_inventory(data_dir, rebuild=False):
+    """
+    Load the inventory of data_dir, building and saving it first if it does
+    not exist, is stale or rebuild is set
+    """
+    path = os.path.join(data_dir, INVENTORY_FILE)
+    if os.path.isfile(path) and not rebuild:
+        try:
+            inventory = EntityInventory.load(path)
+            if inventory.is_fresh(data_dir):
+                return inventory
+            logger.info(f"Entity inventory {path} is stale, rebuilding it")
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(
+                f"Could not load entity inventory {path} ({e}), rebuilding it"
+            )
+    inventory = EntityInventory.build(data_dir)
+    inventory.save(path)
+    return inventory
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data_dir", dest="data_dir", type=str, help="Data directory", required=True
+    )
+    parser.add_argument(
+        "--rebuild",
+        dest="rebuild",
+        action="store_true",
+        help="Rebuild the inventory even if it is up to date",
+    )
+    args = parser.parse_args()
+
+    inventory = load_inventory(args.data_dir, rebuild=args.rebuild)
+    print(f"{len(inventory)} entities in {os.path.join(args.data_dir, INVENTORY_FILE)}")
+    for split, counts in inventory.counts.items():
+        print(
+            f"{split}: {inventory.meta['sentences'][split]} sentences, "
+            f"{int(counts.sum())} entity occurrences, "
+            f"{int((counts > 0).sum())} unique"
+        )
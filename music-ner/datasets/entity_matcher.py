@@ -0,0 +1,112 @@
+"""
+Token-level Aho-Corasick automaton finding all the occurrences of a set of
+entities in sentences
+
+The automaton is built once from all the entities, each a sequence of words,
+and finds the occurrences of all of them in a sentence in a single pass over
+its words, overlapping occurrences included. A matcher built from all the
+linked mentions of a dataset can be reused to mask its sentences for any
+subset of the mentions (see ds_utils.mask_ents).
+"""
+
+from collections import deque
+
+
+class EntityMatcher:
+    """
+    Aho-Corasick automaton over the words of entities
+
+    :param entities: entities as strings, their words separated by spaces
+    """
+
+    def __init__(self, entities=()):
+        # State 0 is the root, each state has its transitions by word, its
+        # failure state and the ids of the entities ending in it
+        self.goto = [{}]
+        self.fail = [0]
+        self.outputs = [[]]
+        self.entity_ids = {}
+        self.lengths = []
+        for entity in entities:
+            self._add(entity)
+        self._build()
+
+    def _add(self, entity):
+        if entity in self.entity_ids:
+            return
+        words = entity.split()
+        self.entity_ids[entity] = len(self.lengths)
+        self.lengths.append(len(words))
+        # Empty entities are never matched
+        if not words:
+            return
+        state = 0
+        for word in words:
+            next_state = self.goto[state].get(word)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][word] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.outputs.append([])
+            state = next_state
+        self.outputs[state].append(self.entity_ids[entity])
+
+    def _build(self):
+        """
+        Compute the failure states breadth first, and merge the outputs of
+        each state with those of its failure state
+        """
+        states = deque(self.goto[0].values())
+        while states:
+            state = states.popleft()
+            for word, next_state in self.goto[state].items():
+                states.append(next_state)
+                fail = self.fail[state]
+                while fail and word not in self.goto[fail]:
+                    fail = self.fail[fail]
+                fail = self.goto[fail].get(word, 0)
+                self.fail[next_state] = fail
+                self.outputs[next_state] = self.outputs[next_state] + self.outputs[fail]
+
+    def __len__(self):
+        return len(self.entity_ids)
+
+    def __contains__(self, entity):
+        return entity in self.entity_ids
+
+    def find(self, words):
+        """
+        Find all the occurrences of the entities in a sentence
+
+        :param words: words of the sentence
+        :return: list of (start, stop, entity id) with stop excluded
+        """
+        matches = []
+        state = 0
+        for i, word in enumerate(words):
+            while state and word not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(word, 0)
+            for entity_id in self.outputs[state]:
+                matches.append((i + 1 - self.lengths[entity_id], i + 1, entity_id))
+        return matches
+
+    def spans(self, words, entities):
+        """
+        Find the occurrences of some of the entities in a sentence
+
+        :param words: words of the sentence
+        :param entities: entities to look for, which must have been given to
+            the matcher
+        :return: set of (start, stop) spans with stop excluded
+        """
+        try:
+            entity_ids = {self.entity_ids[entity] for entity in entities}
+        except KeyError as e:
+            raise ValueError(f"Entity {e} is unknown to the matcher") from e
+        return {
+            (start, stop)
+            for start, stop, entity_id in self.find(words)
+            if entity_id in entity_ids
+        }
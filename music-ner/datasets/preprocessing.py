@@ -1,11 +1,127 @@
 import re
-import nltk
-import pandas as pd
+import csv
+import os
+import json
+import logging
 import argparse
+import threading
+import multiprocessing
+from collections import OrderedDict, deque
+from itertools import islice
+
+
+logger = logging.getLogger(__name__)
+
+# Change when the processing changes, to invalidate the caches saved by WrittenQueryProcessor.save_cache
+CACHE_VERSION = 1
+
+
+def nltk_sent_tokenize(text):
+    # nltk is only needed by the nltk sentence splitter
+    import nltk
+    return nltk.sent_tokenize(text)
+
+
+class QuerySentenceSplitter:
+    """
+    Lightweight sentence splitter for the lowercase, single space separated lines of the pipeline, agreeing with
+    nltk's Punkt on them: a sentence ends with a word ending with a punctuation mark, unless it is an abbreviation
+
+    Dots of the abbreviations of at most 2 letters are already removed by remove_dot_special_cases, so only the longer
+    ones and the ones it keeps need to be listed.
+    """
+    abbreviations = {'st', 'ft', 'bros', 'mrs', 'inc', 'ltd', 'corp', 'dept', 'approx'}
+    # Characters split from the start of the words by Punkt before looking for abbreviations
+    word_start_chars = '([)]&@'
+
+    def __init__(self, punctmarks=('.', '?', '!')):
+        self.punctmarks = set(punctmarks)
+
+    def tokenize(self, text):
+        sents = []
+        words = []
+        for word in text.split():
+            words.append(word)
+            if word[-1] in self.punctmarks and (word[-1] != '.' or word[:-1].lstrip(self.word_start_chars) not in self.abbreviations):
+                sents.append(' '.join(words))
+                words = []
+        if words:
+            sents.append(' '.join(words))
+        return sents
+
+
+class LRUCache:
+    """
+    Thread-safe mapping keeping the max_size most recently used entries, counting the hits and misses of get
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def add_hits(self, n):
+        """
+        Count n hits of entries served without calling get
+        """
+        with self.lock:
+            self.hits += n
+
+    def put(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def items(self):
+        """
+        Entries from the least to the most recently used
+        """
+        with self.lock:
+            return list(self.entries.items())
+
+    def info(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries), 'max_size': self.max_size}
+
+
+class BasicCharTable(dict):
+    """
+    str.translate table doing the character replacements of process_sent_basic,
+    filled lazily with the characters met
+    """
+    def __init__(self, processor):
+        super().__init__()
+        self.processor = processor
+
+    def __missing__(self, code):
+        c = chr(code)
+        p = self.processor
+        if c.isalnum() or c in p.keep or c in p.start_parantheses or c in p.end_parantheses or c in p.punctmarks:
+            value = c
+        elif c in p.discard:
+            value = None
+        elif c in p.newline:
+            value = '\n'
+        else:
+            value = ' '
+        self[code] = value
+        return value
 
 
 class WrittenQueryProcessor:
-    def __init__(self):
+    def __init__(self, fast=False, sentence_splitter='nltk', cache_size=0):
         self.keep = {'$', '&', '+', '@', '¿'}
         self.discard = {'"', "'", '*', '«', '»', '́', '‘', '’', '“', '”', '„'}
         self.punctmarks = {'.', '?', '!'}
@@ -16,35 +132,121 @@ class WrittenQueryProcessor:
         self.special_abbrv = {'remix', 'prod', 'vol', 'mvt', 'mix', 'feat', 'alt', 'aka'}
         self.MIN_SENT = 3
 
+        self.sentence_splitter = sentence_splitter
+        if sentence_splitter == 'nltk':
+            self.sent_tokenize = nltk_sent_tokenize
+        elif sentence_splitter == 'simple':
+            self.sent_tokenize = QuerySentenceSplitter(self.punctmarks).tokenize
+        else:
+            raise ValueError(f"Unknown sentence splitter {sentence_splitter}, expected nltk or simple")
+
+        # Fast mode: same output as the step by step pipeline, see process_sent_fast
+        self.fast = fast
+        self.basic_table = BasicCharTable(self)
+        self.punctmark_repetitions_re = re.compile(r'[\.|?|!]{2,}')
+        self.punctmark_inword_re = re.compile(r'(?<=[^ ])[.?!](?=[^ ])')
+        self.punctmark_table = str.maketrans('', '', '.|?!')
+
+        # Cache of the results of the last cache_size distinct queries, disabled if 0
+        self.cache = LRUCache(cache_size) if cache_size > 0 else None
+
     def processing_pipeline(self, sents):
-        result = []
-        for sent in sents:
-            sent = sent.lower()
+        if self.cache is not None:
+            return [self.process_sent_cached(sent) for sent in sents]
+        if self.fast:
+            return [self.process_sent_fast(sent) for sent in sents]
+        return [self.process_sent(sent) for sent in sents]
+
+    def process_sent(self, sent):
+        sent = sent.lower()
 
-            # Step 1: the basic processing neglects the more complicated cases and treats only the cases where the cleaning is deterministic (a non-alphanumeric character of a certain type is replaced either with space, empty string or newline)
-            sent = self.process_sent_basic(sent)
+        # Step 1: the basic processing neglects the more complicated cases and treats only the cases where the cleaning is deterministic (a non-alphanumeric character of a certain type is replaced either with space, empty string or newline)
+        sent = self.process_sent_basic(sent)
 
-            # Step 2: deal with punctuation marks when they repeat
-            sent = self.remove_punctmark_repetitions(sent)
+        # Step 2: deal with punctuation marks when they repeat
+        sent = self.remove_punctmark_repetitions(sent)
 
-            # Step 3: deal with punctuation marks when they are at the end
-            sent = self.remove_final_punctmark(sent)
+        # Step 3: deal with punctuation marks when they are at the end
+        sent = self.remove_final_punctmark(sent)
 
-            # Step 4: remove the punctuation marks inside the words
-            sent = self.remove_punctmark_inword(sent)
+        # Step 4: remove the punctuation marks inside the words
+        sent = self.remove_punctmark_inword(sent)
 
-            # Step 5: treat special cases involving dot
-            sent = self.remove_dot_special_cases(sent)
+        # Step 5: treat special cases involving dot
+        sent = self.remove_dot_special_cases(sent)
 
-            # Step 6: split by punctuation marks and remove the marks
-            sent = self.process_final_punctmark(sent)
+        # Step 6: split by punctuation marks and remove the marks
+        sent = self.process_final_punctmark(sent)
 
-            # Step 7: deal with the parantheses; most of the cases will create newlines apart from the case when the parantheses are inside or are part of emoticons, being replaced then by empty string
-            sent = self.process_parantheses(sent)
+        # Step 7: deal with the parantheses; most of the cases will create newlines apart from the case when the parantheses are inside or are part of emoticons, being replaced then by empty string
+        sent = self.process_parantheses(sent)
+        return sent
 
-            result.append(sent)
+    def process_sent_cached(self, sent):
+        result = self.cache.get(sent)
+        if result is None:
+            result = self.process_sent_fast(sent) if self.fast else self.process_sent(sent)
+            self.cache.put(sent, result)
         return result
 
+    def cache_info(self):
+        if self.cache is None:
+            return None
+        return self.cache.info()
+
+    def save_cache(self, path):
+        """
+        Save the cached queries to a json file, with the settings changing the processing
+        """
+        with open(path, 'w') as _:
+            json.dump({'version': CACHE_VERSION, 'sentence_splitter': self.sentence_splitter,
+                       'entries': self.cache.items()}, _)
+
+    def load_cache(self, path):
+        """
+        Fill the cache with the queries saved by save_cache, unless they were processed with other settings
+        """
+        with open(path, 'r') as _:
+            saved = json.load(_)
+        if saved['version'] != CACHE_VERSION or saved['sentence_splitter'] != self.sentence_splitter:
+            logger.warning(f"Ignoring {path}, saved with other processing settings")
+            return
+        for sent, result in saved['entries']:
+            self.cache.put(sent, result)
+
+    def process_sent_fast(self, sent):
+        sent = sent.lower()
+
+        # Steps 1 to 4 with a translation table and precompiled regexes
+        sent = sent.translate(self.basic_table).strip()
+        sent = self.punctmark_repetitions_re.sub(' ', sent)
+        if sent and sent[-1] in self.punctmarks:
+            sent = sent[:-1]
+        sent = self.punctmark_inword_re.sub('', sent)
+
+        # Steps 5 to 7 in a single pass over the lines
+        final_sents = []
+        for line in sent.split('\n'):
+            line = ' '.join(self.remove_dot_special_case(word) if '.' in word else word for word in line.split())
+            if not line:
+                continue
+            # A line without punctuation mark is a single sentence
+            if '.' in line or '?' in line or '!' in line:
+                line = '\n'.join(self.sent_tokenize(line))
+            line = line.translate(self.punctmark_table).strip()
+            if len(line) <= self.MIN_SENT:
+                continue
+            for part in line.split('\n'):
+                # Lines without parantheses are only stripped by step 7
+                if '(' in part or ')' in part or '[' in part or ']' in part:
+                    part = self.process_start_parantheses(part)
+                    part = self.process_end_parantheses(part)
+                    part = self.process_rest_of_parantheses(part)
+                part = part.strip()
+                if len(part) > self.MIN_SENT:
+                    final_sents.append(part)
+        return '\n'.join(final_sents)
+
     def process_sent_basic(self, sent):
         original_characters = list(sent)
         process_characters = []
@@ -64,7 +266,7 @@ class WrittenQueryProcessor:
         return re.sub(r'[\.|?|!]{2,}', ' ', sent)
 
     def remove_final_punctmark(self, sent):
-        if sent[-1] in self.punctmarks:
+        if sent and sent[-1] in self.punctmarks:
             return sent[:-1]
         return sent
 
@@ -79,27 +281,28 @@ class WrittenQueryProcessor:
         sents = text.split('\n')
         final_sents = []
         for sent in sents:
-            words = sent.split()
-            for i in range(len(words)):
-                if len(words[i]) < 2 or len(words[i]) > 6 or '.' not in words[i]:
-                    continue
-                if words[i][0] == '.':
-                    words[i] = words[i].replace('.', '')
-                elif words[i][-1] == '.':
-                    # Cases covered single or 2 letters followed by dot except when these cases are numbers of known vocabulary words
-                    if len(words[i][:-1]) <= 2 and words[i][:-1] not in self.ignore_2char_words and not words[i][:-1].isnumeric():
-                        words[i] = words[i].replace('.', '')
-                    elif words[i][:-1] in self.special_abbrv:
-                        words[i] = words[i].replace('.', '')
+            words = [self.remove_dot_special_case(word) for word in sent.split()]
             final_sents.append(' '.join(words))
         return '\n'.join(final_sents).strip()
 
+    def remove_dot_special_case(self, word):
+        if len(word) < 2 or len(word) > 6 or '.' not in word:
+            return word
+        if word[0] == '.':
+            return word.replace('.', '')
+        elif word[-1] == '.':
+            # Cases covered single or 2 letters followed by dot except when these cases are numbers of known vocabulary words
+            if len(word[:-1]) <= 2 and word[:-1] not in self.ignore_2char_words and not word[:-1].isnumeric():
+                return word.replace('.', '')
+            elif word[:-1] in self.special_abbrv:
+                return word.replace('.', '')
+        return word
+
     def process_final_punctmark(self, text):
         sents = text.split('\n')
         final_sents = []
         for sent in sents:
-            nltk_sents = nltk.sent_tokenize(sent)
-            final_sent = '\n'.join(nltk_sents)
+            final_sent = '\n'.join(self.sent_tokenize(sent))
             for p in self.punctmarks:
                 final_sent = re.sub(r'[\.|?|!]', '', final_sent)
             final_sent = final_sent.strip()
@@ -188,6 +391,95 @@ class WrittenQueryProcessor:
         return sent
 
 
+def read_chunks(corpus, chunk_size):
+    """
+    Lazily read the lines of a corpus file by chunks of chunk_size lines
+    """
+    while True:
+        chunk = [s.replace('\n', '') for s in islice(corpus, chunk_size)]
+        if not chunk:
+            return
+        yield chunk
+
+
+def init_worker(fast, sentence_splitter):
+    global worker_processor
+    worker_processor = WrittenQueryProcessor(fast=fast, sentence_splitter=sentence_splitter)
+
+
+def process_chunk(sents):
+    return worker_processor.processing_pipeline(sents)
+
+
+def submit_chunk(pool, cache, sents):
+    """
+    Send the queries of a chunk to the pool, only the distinct ones missing from the cache if any, counting a cache hit or
+    miss per query of the chunk
+
+    :return: chunk, results already known by query, queries sent and their async results
+    """
+    known = {}
+    misses = sents
+    if cache is not None:
+        misses = []
+        distinct = dict.fromkeys(sents)
+        for sent in distinct:
+            result = cache.get(sent)
+            if result is None:
+                misses.append(sent)
+            else:
+                known[sent] = result
+        # The repetitions of a query in the chunk are served by its first occurrence, hits as in a serial run
+        cache.add_hits(len(sents) - len(distinct))
+    return sents, known, misses, pool.apply_async(process_chunk, (misses,))
+
+
+def write_chunk(writer, cache, sents, known, misses, results):
+    known.update(zip(misses, results.get()))
+    if cache is not None:
+        for sent in misses:
+            cache.put(sent, known[sent])
+    writer.writerows((known[sent], sent) for sent in sents)
+
+
+def preprocess_corpus(original_corpus, output_csv, num_workers=1, chunk_size=10000, fast=True, sentence_splitter='nltk',
+                      cache_size=0, cache_file=None):
+    """
+    Preprocess a corpus with one query per line and write the preprocessed and original queries as csv,
+    streaming the corpus by chunks which are processed in parallel by num_workers processes and written in order
+
+    At most 2 * num_workers chunks are in memory at once. If cache_size > 0, the queries already processed are taken
+    from a cache of the last cache_size distinct queries, loaded from cache_file if it exists and saved to it at the end.
+
+    :return: hits and misses of the cache, counted per query of the corpus (with num_workers > 1, a query repeated in
+        chunks in flight at the same time misses in each of them), None without cache
+    """
+    processor = WrittenQueryProcessor(fast=fast, sentence_splitter=sentence_splitter, cache_size=cache_size)
+    if processor.cache is not None and cache_file is not None and os.path.isfile(cache_file):
+        processor.load_cache(cache_file)
+
+    with open(original_corpus, 'r') as corpus, open(output_csv, 'w', newline='') as output:
+        writer = csv.writer(output, lineterminator='\n')
+        writer.writerow(['preprocessed', 'original'])
+        chunks = read_chunks(corpus, chunk_size)
+        if num_workers == 1:
+            for sents in chunks:
+                writer.writerows(zip(processor.processing_pipeline(sents), sents))
+        else:
+            with multiprocessing.Pool(num_workers, initializer=init_worker, initargs=(fast, sentence_splitter)) as pool:
+                pending = deque()
+                for sents in chunks:
+                    pending.append(submit_chunk(pool, processor.cache, sents))
+                    if len(pending) == 2 * num_workers:
+                        write_chunk(writer, processor.cache, *pending.popleft())
+                while pending:
+                    write_chunk(writer, processor.cache, *pending.popleft())
+
+    if processor.cache is not None and cache_file is not None:
+        processor.save_cache(cache_file)
+    return processor.cache_info()
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -204,12 +496,58 @@ if __name__ == "__main__":
         help="Output csv filepath",
         required=True,
     )
+    parser.add_argument(
+        "--num_workers",
+        dest="num_workers",
+        type=int,
+        help="Number of processes",
+        default=1,
+    )
+    parser.add_argument(
+        "--chunk_size",
+        dest="chunk_size",
+        type=int,
+        help="Number of queries processed at once by a process",
+        default=10000,
+    )
+    parser.add_argument(
+        "--step_by_step",
+        dest="step_by_step",
+        action="store_true",
+        help="Run the step by step pipeline instead of the fast mode, which gives the same output",
+    )
+    parser.add_argument(
+        "--sentence_splitter",
+        dest="sentence_splitter",
+        choices=["nltk", "simple"],
+        help="Sentence splitter: nltk's Punkt, or a lightweight splitter agreeing with it on the queries",
+        default="nltk",
+    )
+    parser.add_argument(
+        "--cache_size",
+        dest="cache_size",
+        type=int,
+        help="Number of distinct queries whose result is cached, 0 to disable the cache",
+        default=0,
+    )
+    parser.add_argument(
+        "--cache_file",
+        dest="cache_file",
+        type=str,
+        help="json file from which the cache is loaded if it exists, and to which it is saved",
+        default=None,
+    )
     args = parser.parse_args()
 
-    processor = WrittenQueryProcessor()
-    with open(args.original_corpus, 'r') as _:
-        sents = [s.replace('\n', '') for s in _.readlines()]
-        results = processor.processing_pipeline(sents)
-        header = ['preprocessed', 'original']
-        df = pd.DataFrame(zip(results, sents), columns=header)
-        df.to_csv(args.output_file, index=False)
+    cache_info = preprocess_corpus(
+        args.original_corpus,
+        args.output_csv,
+        num_workers=args.num_workers,
+        chunk_size=args.chunk_size,
+        fast=not args.step_by_step,
+        sentence_splitter=args.sentence_splitter,
+        cache_size=args.cache_size,
+        cache_file=args.cache_file,
+    )
+    if cache_info is not None:
+        print(f"Cache: {cache_info['hits']} hits, {cache_info['misses']} misses, {cache_info['size']} queries")
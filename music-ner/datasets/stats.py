@@ -3,7 +3,7 @@ import os
 import sys
 
 import pandas as pd
-from ds_utils import entities, get_ents_seen_by_humans, read_sents
+from entity_inventory import load_inventory
 from tabulate import tabulate
 
 if __name__ == "__main__":
@@ -13,32 +13,33 @@ if __name__ == "__main__":
     )
     args = parser.parse_args()
 
-    # read train queries
+    # check the train and test queries exist
     train_fpath = os.path.join(args.data_dir, "train.bio")
     if not os.path.isfile(train_fpath):
         print("{} file not found".format(train_fpath))
         sys.exit(1)
-    train_sents = read_sents(train_fpath).values()
 
-    # read test queries
     test_fpath = os.path.join(args.data_dir, "test.bio")
     if not os.path.isfile(test_fpath):
         print("{} file not found".format(test_fpath))
         sys.exit(1)
-    sents = read_sents(test_fpath)
-    test_sents = sents.values()
 
-    print("Nb of queries in train", len(train_sents))
-    print("Nb of queries in test", len(test_sents))
+    # entities of train and test with their number of occurrences, computed
+    # once per data directory
+    inventory = load_inventory(args.data_dir)
+    n_test_sents = inventory.meta["sentences"]["test"]
 
-    train_ents = entities(train_sents)
-    test_ents = entities(test_sents)
+    print("Nb of queries in train", inventory.meta["sentences"]["train"])
+    print("Nb of queries in test", n_test_sents)
+
+    train_ents = inventory.split_entities("train")
+    test_ents = inventory.split_entities("test")
 
     all_stats = []
     for etype in train_ents:
         stats = [etype]
-        stats.append(len(train_ents[etype]))
-        stats.append(len(test_ents[etype]))
+        stats.append(sum(train_ents[etype].values()))
+        stats.append(sum(test_ents[etype].values()))
         unique_train = set(train_ents[etype])
         unique_test = set(test_ents[etype])
         stats.append(len(unique_train))
@@ -69,25 +70,20 @@ if __name__ == "__main__":
         sys.exit(1)
     df = pd.read_csv(ents_fpath)
     df.fillna("", inplace=True)
-    test_ents_all = set(test_ents["Artist"] + test_ents["WoA"])
+    test_ents_all = set(test_ents["Artist"]) | set(test_ents["WoA"])
+    n_test_artists = sum(test_ents["Artist"].values())
+    n_test_woas = sum(test_ents["WoA"].values())
     print(
         "Ratio unique Artist entitites",
-        round(
-            len(test_ents["Artist"])
-            / (len(test_ents["Artist"]) + len(test_ents["WoA"])),
-            2,
-        ),
+        round(n_test_artists / (n_test_artists + n_test_woas), 2),
     )
     print(
         "Ratio unique WoA entitites",
-        round(
-            len(test_ents["WoA"]) / (len(test_ents["Artist"]) + len(test_ents["WoA"])),
-            2,
-        ),
+        round(n_test_woas / (n_test_artists + n_test_woas), 2),
     )
     print(
         "Ratio queries with no entities",
-        round(len(set(sents.keys()) - set(df["query"].to_list())) / len(sents), 2),
+        round(inventory.meta["unlinked_test_sentences"] / n_test_sents, 2),
     )
     ents_per_query = df.groupby(["query"]).size().reset_index(name="counts")
     print(
@@ -118,7 +114,7 @@ if __name__ == "__main__":
         round(len(pretrained_seen) / len(test_ents_all), 2),
     )
 
-    seen_humans = get_ents_seen_by_humans(args.data_dir)
+    seen_humans = inventory.human_known_entities()
     # how many entities declared known by people on average
     print(
         "Ratio total number of entities seen by humans",
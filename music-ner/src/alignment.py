@@ -0,0 +1,64 @@
+"""
+Alignment of token predictions with words, on whole batches
+
+The word ids of a batch encoding of a fast tokenizer are gathered in a
+matrix (one row per sentence, one column per token, -1 for special tokens
+and padding), from which the first sub-token of each word is found without
+looping over tokens in Python.
+"""
+
+from itertools import chain
+
+import numpy as np
+
+
+def word_id_matrix(encodings):
+    """
+    Build the word id matrix of a batch encoding of a fast tokenizer
+
+    :param encodings: BatchEncoding of sentences given as lists of words
+    :return: word ids of shape (sentences, longest sentence in tokens), -1 for
+        special tokens and padding, and the length in tokens of each sentence
+    """
+    return pad_word_ids([encoding.word_ids for encoding in encodings.encodings])
+
+
+def pad_word_ids(word_ids):
+    """
+    Build the word id matrix of lists of word ids
+
+    :param word_ids: word ids of the tokens of each sentence, None or -1 for
+        special tokens
+    :return: word id matrix and length in tokens of each sentence, see
+        word_id_matrix
+    """
+    lengths = np.fromiter(map(len, word_ids), dtype=np.int64, count=len(word_ids))
+    # None (special tokens) is read as NaN
+    flat = np.fromiter(chain.from_iterable(word_ids), dtype=float, count=lengths.sum())
+    matrix = np.full((len(lengths), lengths.max(initial=0)), -1, dtype=np.int64)
+    matrix[np.arange(matrix.shape[1]) < lengths[:, None]] = np.nan_to_num(flat, nan=-1)
+    return matrix, lengths
+
+
+def first_subtoken_mask(word_ids):
+    """
+    Mask of the tokens starting a word in a word id matrix
+    """
+    previous = np.full_like(word_ids, -1)
+    previous[:, 1:] = word_ids[:, :-1]
+    return (word_ids >= 0) & (word_ids != previous)
+
+
+def first_subtoken_predictions(predictions, word_ids):
+    """
+    Keep the prediction of the first token of each word, words cut by
+    truncation having no prediction
+
+    :param predictions: predicted label ids of shape (sentences, tokens)
+    :param word_ids: word id matrix of the same sentences, see word_id_matrix
+    :return: array of word predictions per sentence
+    """
+    n_tokens = min(predictions.shape[1], word_ids.shape[1])
+    first = first_subtoken_mask(word_ids[:, :n_tokens])
+    flat = predictions[:, :n_tokens][first]
+    return np.split(flat, np.cumsum(first.sum(axis=1))[:-1])
@@ -0,0 +1,215 @@
+"""
+Length-bucketed batching for the Trainer of fine-tune.py
+
+Queries are grouped with queries of similar lengths so batches are padded
+little, either with a fixed number of queries per batch or with a budget of
+tokens (padding included) per batch.
+"""
+
+import logging
+
+import datasets
+import numpy as np
+from torch.utils.data import DataLoader, Sampler
+from transformers import EvalPrediction, Trainer
+
+logger = logging.getLogger(__name__)
+
+
+def bucket_bounds(sorted_lengths, batch_size=None, max_tokens=None):
+    """
+    Split lengths sorted in increasing order in consecutive batches
+
+    :param sorted_lengths: lengths sorted in increasing order
+    :param batch_size: number of examples per batch, used if max_tokens is None
+    :param max_tokens: maximum number of tokens per batch once padded to its
+        longest example; longer examples form a batch on their own
+    :return: array with the start of each batch followed by the total length
+    """
+    n = len(sorted_lengths)
+    if max_tokens is None:
+        return np.append(np.arange(0, n, batch_size), n)
+    bounds = [0]
+    for i, length in enumerate(sorted_lengths):
+        if i > bounds[-1] and (i - bounds[-1] + 1) * length > max_tokens:
+            bounds.append(i)
+    bounds.append(n)
+    return np.array(bounds)
+
+
+def padding_efficiency(lengths, batches):
+    """
+    Ratio of real tokens over tokens once batches are padded to their longest example
+    """
+    lengths = np.asarray(lengths)
+    padded = sum(len(batch) * lengths[batch].max() for batch in batches if len(batch))
+    return float(lengths.sum() / padded) if padded else 1.0
+
+
+class LengthBucketBatchSampler(Sampler):
+    """
+    Batch sampler yielding batches of examples of similar lengths
+
+    Without shuffling, examples are sorted by length and the batches follow
+    this order. With shuffling, examples of the same length are shuffled and
+    the batches are yielded in random order, differently at each epoch; as
+    the sorted lengths stay the same, so do the number and sizes of batches.
+    """
+
+    def __init__(
+        self, lengths, batch_size=None, max_tokens=None, shuffle=False, seed=0
+    ):
+        if batch_size is None and max_tokens is None:
+            raise ValueError("Either batch_size or max_tokens must be set")
+        self.lengths = np.asarray(lengths)
+        self.bounds = bucket_bounds(
+            np.sort(self.lengths, kind="stable"), batch_size, max_tokens
+        )
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        # Order in which examples are yielded when not shuffled
+        self.order = np.argsort(self.lengths, kind="stable")
+
+    def __len__(self):
+        return len(self.bounds) - 1
+
+    def batches(self, order):
+        return [order[s:e] for s, e in zip(self.bounds[:-1], self.bounds[1:])]
+
+    @property
+    def padding_efficiency(self):
+        return padding_efficiency(self.lengths, self.batches(self.order))
+
+    def __iter__(self):
+        if not self.shuffle:
+            for batch in self.batches(self.order):
+                yield batch.tolist()
+            return
+        rng = np.random.default_rng(self.seed + self.epoch)
+        self.epoch += 1
+        order = np.lexsort((rng.permutation(len(self.lengths)), self.lengths))
+        batches = self.batches(order)
+        for b in rng.permutation(len(batches)):
+            yield batches[b].tolist()
+
+
+class LengthBucketTrainer(Trainer):
+    """
+    Trainer batching the train, evaluation and test datasets by length
+
+    Predictions are put back in the dataset order before computing the
+    metrics and returning them. Evaluation and prediction are bucketed only
+    when running in a single process.
+    """
+
+    def __init__(
+        self, *args, length_bucketing=False, max_tokens_per_batch=None, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.length_bucketing = length_bucketing or max_tokens_per_batch is not None
+        self.max_tokens_per_batch = max_tokens_per_batch
+        self.padding_efficiency = {}
+
+    def _bucketed_dataloader(self, dataset, description, batch_size, shuffle):
+        dataset = self._remove_unused_columns(dataset, description=description)
+        batch_sampler = LengthBucketBatchSampler(
+            [len(input_ids) for input_ids in dataset["input_ids"]],
+            batch_size=batch_size,
+            max_tokens=self.max_tokens_per_batch,
+            shuffle=shuffle,
+            seed=self.args.seed,
+        )
+        self.padding_efficiency[description] = batch_sampler.padding_efficiency
+        logger.info(
+            f"{len(batch_sampler)} {description} batches, padding efficiency "
+            f"{batch_sampler.padding_efficiency:.3f}"
+        )
+        dataloader = DataLoader(
+            dataset,
+            batch_sampler=batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        # Trainer runs on accelerate from transformers 4.28 on
+        if hasattr(self, "accelerator"):
+            return self.accelerator.prepare(dataloader)
+        return dataloader
+
+    def _bucketing(self, dataset, training=False):
+        return (
+            self.length_bucketing
+            and isinstance(dataset, datasets.Dataset)
+            and (training or self.args.world_size == 1)
+        )
+
+    def get_train_dataloader(self):
+        if not self._bucketing(self.train_dataset, training=True):
+            return super().get_train_dataloader()
+        return self._bucketed_dataloader(
+            self.train_dataset, "training", self._train_batch_size, shuffle=True
+        )
+
+    def get_eval_dataloader(self, eval_dataset=None):
+        dataset = eval_dataset if eval_dataset is not None else self.eval_dataset
+        if not self._bucketing(dataset):
+            return super().get_eval_dataloader(eval_dataset)
+        return self._bucketed_dataloader(
+            dataset, "evaluation", self.args.eval_batch_size, shuffle=False
+        )
+
+    def get_test_dataloader(self, test_dataset):
+        if not self._bucketing(test_dataset):
+            return super().get_test_dataloader(test_dataset)
+        return self._bucketed_dataloader(
+            test_dataset, "test", self.args.eval_batch_size, shuffle=False
+        )
+
+    def evaluation_loop(
+        self,
+        dataloader,
+        description,
+        prediction_loss_only=None,
+        ignore_keys=None,
+        metric_key_prefix="eval",
+    ):
+        batch_sampler = getattr(dataloader, "batch_sampler", None)
+        if not isinstance(batch_sampler, LengthBucketBatchSampler):
+            return super().evaluation_loop(
+                dataloader,
+                description,
+                prediction_loss_only=prediction_loss_only,
+                ignore_keys=ignore_keys,
+                metric_key_prefix=metric_key_prefix,
+            )
+
+        # Position of each example of the dataset in the bucketed order
+        inverse = np.argsort(batch_sampler.order)
+        compute_metrics = self.compute_metrics
+        if compute_metrics is not None:
+            self.compute_metrics = lambda p: compute_metrics(
+                EvalPrediction(
+                    predictions=p.predictions[inverse], label_ids=p.label_ids[inverse]
+                )
+            )
+        try:
+            output = super().evaluation_loop(
+                dataloader,
+                description,
+                prediction_loss_only=prediction_loss_only,
+                ignore_keys=ignore_keys,
+                metric_key_prefix=metric_key_prefix,
+            )
+        finally:
+            self.compute_metrics = compute_metrics
+
+        output.metrics[f"{metric_key_prefix}_padding_efficiency"] = (
+            batch_sampler.padding_efficiency
+        )
+        return output._replace(
+            predictions=(
+                None if output.predictions is None else output.predictions[inverse]
+            ),
+            label_ids=None if output.label_ids is None else output.label_ids[inverse],
+        )
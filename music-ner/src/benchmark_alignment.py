@@ -0,0 +1,147 @@
+"""
+Benchmark the mapping of the token predictions back to the words done by
+fine-tune.py on the test sets: the former filtering of the tokens labelled
+-100, sentence by sentence, against alignment.first_subtoken_predictions on
+the word ids kept by the tokenization
+
+Both are given the same predictions, padded as returned by Trainer.predict,
+and must give the same word labels; the tokenization time is reported for
+reference.
+"""
+
+import argparse
+import sys
+import time
+
+import numpy as np
+from alignment import first_subtoken_predictions, pad_word_ids
+from tabulate import tabulate
+from transformers import AutoTokenizer
+
+sys.path.append("music-ner/datasets")
+from bio_io import BioCorpus
+
+
+def loop_predictions(predictions, labels, word_ids, label_list):
+    """
+    Word labels predicted for each sentence, computed as fine-tune.py used to
+    """
+    return [
+        [label_list[p] for (p, l) in zip(prediction, label) if l != -100]
+        for prediction, label in zip(predictions, labels)
+    ]
+
+
+def batch_predictions(predictions, labels, word_ids, label_list):
+    """
+    Word labels predicted for each sentence, computed as fine-tune.py does
+    """
+    label_names = np.array(label_list)
+    word_ids, _ = pad_word_ids(word_ids)
+    return [
+        label_names[prediction]
+        for prediction in first_subtoken_predictions(predictions, word_ids)
+    ]
+
+
+def token_labels(word_ids, width):
+    """
+    Label matrix of the sentences as built by fine-tune.py and padded by
+    Trainer.predict, 0 for the first token of each word and -100 elsewhere
+    """
+    labels = np.full((len(word_ids), width), -100)
+    for i, sent_word_ids in enumerate(word_ids):
+        previous_word_idx = None
+        for j, word_idx in enumerate(sent_word_ids):
+            if word_idx is not None and word_idx != previous_word_idx:
+                labels[i, j] = 0
+            previous_word_idx = word_idx
+    return labels
+
+
+def timed(function, repeats, *args):
+    """
+    Best time over repeats of calling function, and its result
+    """
+    best = float("inf")
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_name_or_path",
+        dest="model_name_or_path",
+        type=str,
+        help="Model or directory whose fast tokenizer is used",
+        default="bert-large-uncased",
+    )
+    parser.add_argument(
+        "--data_dirs",
+        dest="data_dirs",
+        type=str,
+        nargs="+",
+        help="Data directories whose test.bio is used",
+        default=[f"data/dataset{i}" for i in range(1, 5)],
+    )
+    parser.add_argument(
+        "--max_seq_length",
+        dest="max_seq_length",
+        type=int,
+        help="Maximum number of tokens per sentence",
+        default=None,
+    )
+    parser.add_argument(
+        "--repeats",
+        dest="repeats",
+        type=int,
+        help="Number of runs, the best time is reported",
+        default=5,
+    )
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name_or_path)
+    rng = np.random.default_rng(0)
+
+    table = []
+    for data_dir in args.data_dirs:
+        corpus = BioCorpus.read(f"{data_dir}/test.bio")
+        words = [list(tokens) for tokens, _ in corpus]
+        label_list = sorted(set(corpus.tag_names))
+
+        start = time.perf_counter()
+        encodings = tokenizer(
+            words,
+            truncation=True,
+            max_length=args.max_seq_length,
+            is_split_into_words=True,
+        )
+        tokenize_time = time.perf_counter() - start
+
+        word_ids = [encoding.word_ids for encoding in encodings.encodings]
+        width = max(map(len, word_ids))
+        labels = token_labels(word_ids, width)
+        predictions = rng.integers(len(label_list), size=(len(words), width))
+
+        inputs = (predictions, labels, word_ids, label_list)
+        loop_time, loop_labels = timed(loop_predictions, args.repeats, *inputs)
+        batch_time, batch_labels = timed(batch_predictions, args.repeats, *inputs)
+        if [list(labels) for labels in batch_labels] != loop_labels:
+            raise AssertionError(f"Different predictions for {data_dir}/test.bio")
+        table.append(
+            [
+                data_dir,
+                len(words),
+                f"{tokenize_time * 1000:.1f}",
+                f"{loop_time * 1000:.1f}",
+                f"{batch_time * 1000:.1f}",
+                f"{loop_time / batch_time:.1f}x",
+            ]
+        )
+
+    headers = ["data", "sentences", "tokenize ms", "loop ms", "batch ms", "speedup"]
+    print(tabulate(table, headers=headers))
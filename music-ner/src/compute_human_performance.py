@@ -4,17 +4,12 @@ import os
 import sys
 
 sys.path.append("music-ner/datasets")
-from ds_utils import read_sents
+from bio_io import BioCorpus
 from eval_utils import compute_results
 
 NO_ANNOTATORS = 3
 
 
-def sent2labels(sent):
-    labels = [label for token, label in sent]
-    return labels
-
-
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument(
@@ -27,6 +22,13 @@ if __name__ == "__main__":
         help="Directory where to export the results",
         required=True,
     )
+    parser.add_argument(
+        "--num_workers",
+        dest="num_workers",
+        type=int,
+        default=None,
+        help="Number of processes used to compute the metrics",
+    )
     args = parser.parse_args()
 
     gtruth_fpaths = {}
@@ -50,8 +52,10 @@ if __name__ == "__main__":
         if gtruth_fpaths[scenario] == "":
             continue
         print(scenario)
-        gtruth_sents = read_sents(gtruth_fpaths[scenario])
-        gtruth_labels = [sent2labels(gtruth_sents[s]) for s in gtruth_sents]
+        # the annotations are paired with the ground truth by sentence id (their
+        # position), which also holds for duplicated queries
+        gtruth_sents = BioCorpus.read(gtruth_fpaths[scenario])
+        gtruth_labels = gtruth_sents.tag_lists()
 
         for i in range(1, NO_ANNOTATORS + 1):
             print("Annotator {}".format(i))
@@ -59,14 +63,22 @@ if __name__ == "__main__":
             print(annot_filepath)
             if not os.path.isfile(annot_filepath):
                 break  # no more annotators
-            annot_sents = read_sents(annot_filepath)
-            annot_labels = [sent2labels(annot_sents[s]) for s in annot_sents]
+            annot_sents = BioCorpus.read(annot_filepath)
+            if len(annot_sents) != len(gtruth_sents):
+                print(
+                    "{} has {} sentences instead of {}".format(
+                        annot_filepath, len(annot_sents), len(gtruth_sents)
+                    )
+                )
+                sys.exit(1)
+            annot_labels = annot_sents.tag_lists()
 
             metrics = compute_results(
                 gtruth_labels,
                 annot_labels,
                 ent_types=["Artist", "WoA", "Artist_or_WoA"],
                 eval_schemas=["strict_weak", "ent_type", "exact"],
+                num_workers=args.num_workers,
             )
             scenario_dir = os.path.join(args.output_dir, scenario)
             if not os.path.exists(scenario_dir):
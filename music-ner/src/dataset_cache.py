@@ -0,0 +1,70 @@
+"""
+On-disk cache of tokenized datasets, shared across runs and processes
+
+Tokenized datasets are saved in Arrow format, memory-mapped when loaded
+back, under a key hashing the content of the BIO file they come from, the
+tokenizer (vocabulary and settings) and the preprocessing options, so runs
+differing only by seed or training hyper-parameters reuse them.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+
+from datasets import load_from_disk
+
+logger = logging.getLogger(__name__)
+
+# Change when the preprocessing changes, to invalidate existing caches
+CACHE_VERSION = 2
+
+
+def tokenizer_digest(tokenizer):
+    """
+    SHA-256 of the serialized fast tokenizer (vocabulary, normalization,
+    special tokens, ...) and of its class
+    """
+    digest = hashlib.sha256(type(tokenizer).__name__.encode())
+    digest.update(tokenizer.backend_tokenizer.to_str().encode())
+    return digest.hexdigest()
+
+
+def cache_key(**parts):
+    """
+    Key of a cached dataset, hashing the given json serializable parts
+    """
+    parts["cache_version"] = CACHE_VERSION
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+def cached_map(dataset, function, cache_dir, key, overwrite=False, **map_kwargs):
+    """
+    Apply function with dataset.map, or load the result saved under key
+
+    The result is written in a temporary directory then renamed, so processes
+    sharing cache_dir never read a partially saved dataset; if several
+    processes compute the same dataset, the first renamed one is kept.
+
+    :param overwrite: recompute the dataset even if it is already cached
+    :param map_kwargs: other arguments of dataset.map
+    """
+    path = os.path.join(cache_dir, key)
+    if os.path.isdir(path) and not overwrite:
+        logger.info(f"Loading tokenized dataset from {path}")
+        return load_from_disk(path)
+
+    dataset = dataset.map(function, **map_kwargs)
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=cache_dir, prefix=f".{key}-")
+    dataset.save_to_disk(tmp_path)
+    if overwrite and os.path.isdir(path):
+        shutil.rmtree(path)
+    try:
+        os.rename(tmp_path, path)
+        logger.info(f"Tokenized dataset saved to {path}")
+    except OSError:
+        shutil.rmtree(tmp_path)
+    return load_from_disk(path)
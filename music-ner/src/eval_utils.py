@@ -1,47 +1,81 @@
-from copy import deepcopy
-
 from ner_eval import Evaluator
 from tabulate import tabulate
 
+# Metrics reported for each schema, in order
+METRICS = [
+    "precision",
+    "recall",
+    "f1",
+    "correct",
+    "incorrect",
+    "partial",
+    "missed",
+    "spurious",
+    "possible",
+    "actual",
+]
+
 
 def compute_results(
     true_labels,
     true_predictions,
     ent_types=["Artist", "WoA"],
     eval_schemas=["strict", "ent_type", "exact"],
+    engine="python",
+    num_workers=None,
+    label_list=None,
 ):
-    metrics_results = {
-        "precision": [],
-        "recall": [],
-        "f1": [],
-        "correct": [],
-        "incorrect": [],
-        "partial": [],
-        "missed": [],
-        "spurious": [],
-        "possible": [],
-        "actual": [],
-    }
-    # overall results
-    results = {}
-    for eval_schema in eval_schemas:
-        results[eval_schema] = deepcopy(metrics_results)
+    """
+    Evaluate the predicted against the true labels and return a flat dict of
+    micro-averaged, macro-averaged and per entity type metrics
+
+    With num_workers > 1, the sentences are split in shards evaluated in a
+    pool of processes; the metrics are the same as with a serial evaluation.
 
+    If label_list is given, true_labels and true_predictions are arrays of
+    tag ids, where the true label -100 marks the positions to ignore, and
+    label_list gives the tag of each id. They are decoded and evaluated with
+    the vectorized engine.
+    """
     all_labels = ent_types
     target_labels = ["Artist", "WoA"]
-    evaluation_agg_entities_type = {e: deepcopy(results) for e in target_labels}
-    evaluator = Evaluator(true_labels, true_predictions, all_labels)
-    tmp_results, tmp_results_agg = evaluator.evaluate()
-    # aggregate overall results
-    for eval_schema in results.keys():
-        for metric in metrics_results:
-            results[eval_schema][metric] = tmp_results[eval_schema][metric]
-    for e_type in target_labels:
-        for eval_schema in results.keys():
-            for metric in metrics_results:
-                evaluation_agg_entities_type[e_type][eval_schema][
-                    metric
-                ] = tmp_results_agg[e_type][eval_schema][metric]
+    # labels can be given as generators, they are evaluated in batches
+    batch_size = 10000
+    if num_workers is not None and num_workers > 1 and hasattr(true_labels, "__len__"):
+        # one shard per worker, unless shards are larger than a batch
+        batch_size = min(batch_size, max(1, -(-len(true_labels) // num_workers)))
+    evaluator = Evaluator(None, None, all_labels, engine=engine)
+    if label_list is not None:
+        evaluator.update_ids(
+            true_labels,
+            true_predictions,
+            label_list,
+            batch_size=batch_size,
+            num_workers=num_workers,
+        )
+    else:
+        evaluator.update_stream(
+            true_labels,
+            true_predictions,
+            batch_size=batch_size,
+            num_workers=num_workers,
+        )
+    tmp_results, tmp_results_agg = evaluator.finalize()
+    # keep the requested schemas and metrics, overall and by entity type
+    results = {
+        eval_schema: {metric: tmp_results[eval_schema][metric] for metric in METRICS}
+        for eval_schema in eval_schemas
+    }
+    evaluation_agg_entities_type = {
+        e_type: {
+            eval_schema: {
+                metric: tmp_results_agg[e_type][eval_schema][metric]
+                for metric in METRICS
+            }
+            for eval_schema in eval_schemas
+        }
+        for e_type in target_labels
+    }
 
     final_results = {}
     for key, value in results.items():
@@ -62,11 +96,11 @@ def compute_results(
             final_results[key] /= len(target_labels)
 
     print("\n Overall")
-    print_results(results, metrics_results)
+    print_results(results, METRICS)
 
     for e_type in target_labels:
         print("\n", e_type)
-        print_results(evaluation_agg_entities_type[e_type], metrics_results)
+        print_results(evaluation_agg_entities_type[e_type], METRICS)
 
     return final_results
 
@@ -75,11 +109,11 @@ def print_results(results, metrics_results):
     """
     Helper to print the results in a table form
     """
-    headers = ["schema"] + list(metrics_results.keys())
+    headers = ["schema"] + list(metrics_results)
     results_tbl = []
     for eval_schema in results.keys():
         row_results_tbl = [eval_schema]
-        for metric in metrics_results.keys():
+        for metric in metrics_results:
             row_results_tbl.append(results[eval_schema][metric])
         results_tbl.append(row_results_tbl)
     print(tabulate(results_tbl, headers=headers))
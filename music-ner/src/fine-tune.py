@@ -16,12 +16,16 @@ import logging
 import os
 import sys
 from dataclasses import dataclass, field
+from functools import lru_cache
 from typing import Optional
 
 import datasets
 import numpy as np
 import torch.nn as nn
 import transformers
+from alignment import first_subtoken_predictions, pad_word_ids
+from batching import LengthBucketTrainer
+from dataset_cache import cache_key, cached_map, tokenizer_digest
 from datasets import ClassLabel, load_dataset
 from eval_utils import compute_results
 from transformers import (
@@ -32,7 +36,6 @@ from transformers import (
     HfArgumentParser,
     PretrainedConfig,
     PreTrainedTokenizerFast,
-    Trainer,
     TrainingArguments,
     set_seed,
 )
@@ -40,6 +43,9 @@ from transformers.trainer_utils import get_last_checkpoint
 from transformers.utils import check_min_version
 from transformers.utils.versions import require_version
 
+sys.path.append("music-ner/datasets")
+from ds_utils import file_digest
+
 # Will error if the minimal version of Transformers is not installed. Remove at your own risks.
 check_min_version("4.18.0.dev0")
 require_version(
@@ -49,6 +55,14 @@ require_version(
 
 logger = logging.getLogger(__name__)
 
+# Memoized so that the runs sharing a process (see sweep.py) load each dataset
+# and tokenizer once
+cached_load_dataset = lru_cache(maxsize=None)(load_dataset)
+cached_tokenizer = lru_cache(maxsize=None)(AutoTokenizer.from_pretrained)
+
+# Configs of music-ner/datasets/datasets.py loading a subdirectory of the data
+SUBSET_CONFIGS = ["seen", "rare_unseen"]
+
 
 @dataclass
 class ModelArguments:
@@ -118,6 +132,13 @@ class DataTrainingArguments:
         default=False,
         metadata={"help": "Overwrite the cached training and evaluation sets"},
     )
+    tokenized_cache_dir: Optional[str] = field(
+        default=None,
+        metadata={
+            "help": "Where to store the tokenized datasets, keyed by the content of the BIO files, the tokenizer and "
+            "the preprocessing arguments, to share them across runs."
+        },
+    )
     preprocessing_num_workers: Optional[int] = field(
         default=None,
         metadata={"help": "The number of processes to use for the preprocessing."},
@@ -177,6 +198,26 @@ class DataTrainingArguments:
             "help": "Whether to re-initialize the last N Transformer blocks, where N is the argument value."
         },
     )
+    length_bucketing: bool = field(
+        default=False,
+        metadata={
+            "help": "Whether to batch together examples of similar lengths, for training, evaluation and prediction, "
+            "to reduce padding."
+        },
+    )
+    max_tokens_per_batch: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "If set, batches hold at most this number of tokens (padding included) instead of a fixed number "
+            "of examples. Implies length bucketing."
+        },
+    )
+    eval_num_workers: Optional[int] = field(
+        default=None,
+        metadata={
+            "help": "The number of processes to use to compute the evaluation metrics."
+        },
+    )
 
     def __post_init__(self):
         if self.dataset_name is None:
@@ -186,22 +227,26 @@ class DataTrainingArguments:
         self.task_name = self.task_name.lower()
 
 
-def main():
+def main(args=None):
     # See all possible arguments in src/transformers/training_args.py
     # or by passing the --help flag to this script.
     # We now keep distinct sets of args, for a cleaner separation of concerns.
+    # args replaces the command line arguments when main is called from Python.
 
+    args = sys.argv[1:] if args is None else args
     parser = HfArgumentParser(
         (ModelArguments, DataTrainingArguments, TrainingArguments)
     )
-    if len(sys.argv) == 2 and sys.argv[1].endswith(".json"):
+    if len(args) == 1 and args[0].endswith(".json"):
         # If we pass only one argument to the script and it's the path to a json file,
         # let's parse it to get our arguments.
         model_args, data_args, training_args = parser.parse_json_file(
-            json_file=os.path.abspath(sys.argv[1])
+            json_file=os.path.abspath(args[0])
         )
     else:
-        model_args, data_args, training_args = parser.parse_args_into_dataclasses()
+        model_args, data_args, training_args = parser.parse_args_into_dataclasses(
+            args=args
+        )
 
     # Setup logging
     logging.basicConfig(
@@ -251,7 +296,7 @@ def main():
     # Get the datasets
     if data_args.dataset_name is not None:
         # Loading the dataset
-        raw_datasets = load_dataset(
+        raw_datasets = cached_load_dataset(
             data_args.dataset_name,
             data_args.dataset_config_name,
             cache_dir=model_args.cache_dir,
@@ -315,14 +360,14 @@ def main():
         else model_args.model_name_or_path
     )
     if config.model_type in {"gpt2", "roberta"}:
-        tokenizer = AutoTokenizer.from_pretrained(
+        tokenizer = cached_tokenizer(
             tokenizer_name_or_path,
             cache_dir=model_args.cache_dir,
             use_fast=True,
             add_prefix_space=True,
         )
     else:
-        tokenizer = AutoTokenizer.from_pretrained(
+        tokenizer = cached_tokenizer(
             tokenizer_name_or_path,
             cache_dir=model_args.cache_dir,
             use_fast=True,
@@ -388,6 +433,7 @@ def main():
             is_split_into_words=True,
         )
         labels = []
+        all_word_ids = []
         for i, label in enumerate(examples[label_column_name]):
             word_ids = tokenized_inputs.word_ids(batch_index=i)
             previous_word_idx = None
@@ -410,9 +456,61 @@ def main():
                 previous_word_idx = word_idx
 
             labels.append(label_ids)
+            all_word_ids.append(word_ids)
+        # Kept to map the predictions back to the words, the Trainer drops
+        # them as the model does not take them
+        tokenized_inputs["word_ids"] = all_word_ids
         tokenized_inputs["labels"] = labels
         return tokenized_inputs
 
+    def tokenize(dataset, split, desc):
+        """
+        Tokenize a dataset split, or load it from the tokenized cache
+        """
+        map_kwargs = dict(
+            batched=True,
+            num_proc=data_args.preprocessing_num_workers,
+            load_from_cache_file=not data_args.overwrite_cache,
+            desc=desc,
+        )
+        if data_args.tokenized_cache_dir is None:
+            return dataset.map(tokenize_and_align_labels, **map_kwargs)
+        # The cache is keyed by the BIO file the split was loaded from, which
+        # is only known when the data directory is given as datasets.py reads
+        # it (relative paths are resolved from the working directory by both)
+        bio_file = None
+        if data_args.dataset_path is not None:
+            data_dir = data_args.dataset_path
+            # The seen and rare_unseen configs of datasets.py load the files of
+            # the subdirectory of the same name
+            if data_args.dataset_config_name in SUBSET_CONFIGS:
+                data_dir = os.path.join(data_dir, data_args.dataset_config_name)
+            bio_file = os.path.join(data_dir, f"{split}.bio")
+        if bio_file is None or not os.path.isfile(bio_file):
+            logger.warning(
+                f"No {split}.bio file in --dataset_path, the tokenized {split} "
+                "dataset is not cached"
+            )
+            return dataset.map(tokenize_and_align_labels, **map_kwargs)
+
+        key = cache_key(
+            bio_file=file_digest(bio_file),
+            num_examples=len(dataset),
+            tokenizer=tokenizer_digest(tokenizer),
+            label_to_id=sorted(label_to_id.items()),
+            max_seq_length=data_args.max_seq_length,
+            pad_to_max_length=data_args.pad_to_max_length,
+            label_all_tokens=data_args.label_all_tokens,
+        )
+        return cached_map(
+            dataset,
+            tokenize_and_align_labels,
+            data_args.tokenized_cache_dir,
+            key,
+            overwrite=data_args.overwrite_cache,
+            **map_kwargs,
+        )
+
     if training_args.do_train:
         if "train" not in raw_datasets:
             raise ValueError("--do_train requires a train dataset")
@@ -420,12 +518,8 @@ def main():
         if data_args.max_train_samples is not None:
             train_dataset = train_dataset.select(range(data_args.max_train_samples))
         with training_args.main_process_first(desc="train dataset map pre-processing"):
-            train_dataset = train_dataset.map(
-                tokenize_and_align_labels,
-                batched=True,
-                num_proc=data_args.preprocessing_num_workers,
-                load_from_cache_file=not data_args.overwrite_cache,
-                desc="Running tokenizer on train dataset",
+            train_dataset = tokenize(
+                train_dataset, "train", desc="Running tokenizer on train dataset"
             )
 
     if training_args.do_eval:
@@ -437,11 +531,9 @@ def main():
         with training_args.main_process_first(
             desc="validation dataset map pre-processing"
         ):
-            eval_dataset = eval_dataset.map(
-                tokenize_and_align_labels,
-                batched=True,
-                num_proc=data_args.preprocessing_num_workers,
-                load_from_cache_file=not data_args.overwrite_cache,
+            eval_dataset = tokenize(
+                eval_dataset,
+                "validation",
                 desc="Running tokenizer on validation dataset",
             )
 
@@ -456,12 +548,8 @@ def main():
         with training_args.main_process_first(
             desc="prediction dataset map pre-processing"
         ):
-            predict_dataset = predict_dataset.map(
-                tokenize_and_align_labels,
-                batched=True,
-                num_proc=data_args.preprocessing_num_workers,
-                load_from_cache_file=not data_args.overwrite_cache,
-                desc="Running tokenizer on prediction dataset",
+            predict_dataset = tokenize(
+                predict_dataset, "test", desc="Running tokenizer on prediction dataset"
             )
 
     # Data collator
@@ -477,17 +565,14 @@ def main():
         predictions, labels = p
         predictions = np.argmax(predictions, axis=2)
 
-        # Remove ignored index (special tokens)
-        true_predictions = [
-            [label_list[p] for (p, l) in zip(prediction, label) if l != -100]
-            for prediction, label in zip(predictions, labels)
-        ]
-        true_labels = [
-            [label_list[l] for (p, l) in zip(prediction, label) if l != -100]
-            for prediction, label in zip(predictions, labels)
-        ]
-
-        final_results = compute_results(true_labels, true_predictions)
+        # Tag ids are evaluated directly, the ignored index (special tokens) is
+        # skipped while decoding the entities
+        final_results = compute_results(
+            labels,
+            predictions,
+            label_list=label_list,
+            num_workers=data_args.eval_num_workers,
+        )
         return final_results
 
     # Re-initialise last layers; works only for BERT-like models
@@ -518,7 +603,7 @@ def main():
                 if isinstance(module, nn.Linear) and module.bias is not None:
                     module.bias.data.zero_()
 
-    trainer = Trainer(
+    trainer = LengthBucketTrainer(
         model=model,
         args=training_args,
         train_dataset=train_dataset if training_args.do_train else None,
@@ -526,6 +611,8 @@ def main():
         tokenizer=tokenizer,
         data_collator=data_collator,
         compute_metrics=compute_metrics,
+        length_bucketing=data_args.length_bucketing,
+        max_tokens_per_batch=data_args.max_tokens_per_batch,
     )
 
     # Training
@@ -544,6 +631,8 @@ def main():
             else len(train_dataset)
         )
         metrics["train_samples"] = min(max_train_samples, len(train_dataset))
+        if "training" in trainer.padding_efficiency:
+            metrics["train_padding_efficiency"] = trainer.padding_efficiency["training"]
         trainer.log_metrics("train", metrics)
         trainer.save_metrics("train", metrics)
         trainer.save_state()
@@ -568,10 +657,12 @@ def main():
             predict_dataset, metric_key_prefix="predict"
         )
         predictions = np.argmax(predictions, axis=2)
-        # Remove ignored index (special tokens)
+        # Keep the prediction of the first token of each word
+        word_ids, _ = pad_word_ids(predict_dataset["word_ids"])
+        label_names = np.array(label_list)
         true_predictions = [
-            [label_list[p] for (p, l) in zip(prediction, label) if l != -100]
-            for prediction, label in zip(predictions, pred_labels)
+            label_names[prediction]
+            for prediction in first_subtoken_predictions(predictions, word_ids)
         ]
         trainer.log_metrics("predict", pred_metrics)
         trainer.save_metrics("predict", pred_metrics)
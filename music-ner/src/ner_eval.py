@@ -8,9 +8,30 @@
 # to EACL 2023
 
 import logging
-from collections import namedtuple
-from copy import deepcopy
+import multiprocessing
+from collections import deque, namedtuple
 from difflib import SequenceMatcher
+from itertools import islice
+
+import numpy as np
+from span_matching import (
+    AOW,
+    COUNTS,
+    EXACT,
+    MISSED,
+    OVERLAP,
+    OVERLAP_AOW,
+    PATTERNS,
+    SCHEMAS,
+    SPURIOUS,
+    SWAPPED,
+    SWAPPED_AOW,
+    SWAPPED_TYPE,
+    WEIGHTED,
+    SpanCounts,
+    count_label_ids,
+    count_matches,
+)
 
 logging.basicConfig(
     format="%(asctime)s %(name)s %(levelname)s: %(message)s",
@@ -21,40 +42,48 @@ logging.basicConfig(
 Entity = namedtuple("Entity", "e_type start_offset end_offset")
 
 
+ENGINES = ("python", "numpy")
+
+
 class Evaluator:
-    def __init__(self, true, pred, tags):
-        if len(true) != len(pred):
+    def __init__(self, true, pred, tags, engine="python"):
+        """
+        :param true: a list of lists of true tags, or None when the sentences
+            are given in batches with update / update_stream
+        :param pred: a list of lists of predicted tags, or None
+        :param tags: entity types to evaluate; as in the original
+            implementation, the counters of a type given several times are
+            counted once per occurrence
+        :param engine: "python" to match entities sentence by sentence, or
+            "numpy" to match all the spans of a batch at once with the
+            vectorized engine of span_matching (same results, much faster)
+        """
+        if true is None and pred is None:
+            true, pred = [], []
+        if true is None or pred is None or len(true) != len(pred):
             raise ValueError("Number of predicted does not equal true")
+        if engine not in ENGINES:
+            raise ValueError(f"Unknown engine {engine}, expected one of {ENGINES}")
 
         self.true = true
         self.pred = pred
         self.tags = tags
-
-        # Setup dict into which metrics will be stored.
-        self.metrics_results = {
-            "correct": 0,
-            "incorrect": 0,
-            "partial": 0,
-            "missed": 0,
-            "spurious": 0,
-            "possible": 0,
-            "actual": 0,
-            "precision": 0,
-            "recall": 0,
-            "f1": 0,
-        }
-
-        # Copy results dict to cover the four schemes.
-        self.results = {
-            "strict": deepcopy(self.metrics_results),
-            "strict_weak": deepcopy(self.metrics_results),
-            "exact": deepcopy(self.metrics_results),
-            "ent_type": deepcopy(self.metrics_results),
-            "ent_type_weighted": deepcopy(self.metrics_results),
-        }
-
-        # Create an accumulator to store results
-        self.evaluation_agg_entities_type = {e: deepcopy(self.results) for e in tags}
+        self.engine = engine
+
+        # Raw counters summed over sentences, the first row for the overall
+        # results and one row per entity type; the nested results dicts are
+        # only built from them when the results are requested
+        self.types = list(dict.fromkeys(tags))
+        n_rows = len(self.types) + 1
+        # Number of times the counters of each row are added
+        self.repeats = np.array([1] + [tags.count(e_type) for e_type in self.types])
+        self.counts = np.zeros((n_rows, len(SCHEMAS), len(COUNTS)), dtype=np.int64)
+        # ent_type_weighted correct, possible and actual, which are similarity
+        # weighted (floats) once is_weighted is set for the row
+        self.weighted = np.zeros((n_rows, len(WEIGHTED)))
+        self.is_weighted = np.zeros(n_rows, dtype=bool)
+
+        self.results, self.evaluation_agg_entities_type = self.partial()
 
     def evaluate(self):
         logging.info(
@@ -62,46 +91,234 @@ class Evaluator:
             len(self.pred),
             len(self.true),
         )
+        self.update(self.true, self.pred)
+        return self.finalize()
+
+    def update(self, true, pred):
+        """
+        Accumulate the counters of a batch of sentences
+
+        :param true: a list of lists of true tags
+        :param pred: a list of lists of predicted tags
+        """
+        self.add_counts(*count_batch(true, pred, self.tags, self.engine))
+
+    def update_ids(
+        self, true_ids, pred_ids, label_list, batch_size=10000, num_workers=None
+    ):
+        """
+        Accumulate the counters of sentences given as arrays of tag ids (see
+        span_matching.count_label_ids); whatever the engine, spans are decoded
+        and matched with the vectorized one
+
+        :param true_ids: (sentences, tokens) array of true tag ids, with -100
+            for the positions to ignore
+        :param pred_ids: (sentences, tokens) array of predicted tag ids
+        :param label_list: the tags corresponding to the ids
+        :param batch_size: number of sentences per shard with num_workers
+        :param num_workers: number of processes evaluating the shards
+        """
+        if num_workers is None or num_workers <= 1:
+            self.add_counts(*count_label_ids(true_ids, pred_ids, label_list, self.tags))
+            return
+        true_ids, pred_ids = np.asarray(true_ids), np.asarray(pred_ids)
+        tasks = (
+            (true_ids[i : i + batch_size], pred_ids[i : i + batch_size])
+            + (label_list, self.tags)
+            for i in range(0, len(true_ids), batch_size)
+        )
+        with multiprocessing.Pool(num_workers) as pool:
+            for counters in pool.imap(_count_label_ids, tasks):
+                self.add_counts(*counters)
+
+    def update_stream(self, true, pred, batch_size=10000, num_workers=None):
+        """
+        Accumulate the counters of sentences read from iterables (e.g.
+        generators over prediction files), batch_size sentences at a time so
+        that the memory used does not grow with the number of sentences
+
+        With num_workers > 1, the batches are evaluated in a pool of processes
+        and their counters are added in order, so the results are the same as
+        with a serial evaluation. At most 2 * num_workers batches are read
+        ahead of the one whose counters are added.
+        """
+        true, pred = iter(true), iter(pred)
+        n_sents = 0
+
+        def batches():
+            nonlocal n_sents
+            while True:
+                true_batch = list(islice(true, batch_size))
+                pred_batch = list(islice(pred, batch_size))
+                if not true_batch and not pred_batch:
+                    return
+                n_sents += len(true_batch)
+                yield true_batch, pred_batch, self.tags, self.engine
+
+        if num_workers is not None and num_workers > 1:
+            with multiprocessing.Pool(num_workers) as pool:
+                # Pool.imap would read all the batches ahead of the workers
+                pending = deque()
+                for batch in batches():
+                    pending.append(pool.apply_async(count_batch, batch))
+                    if len(pending) == 2 * num_workers:
+                        self.add_counts(*pending.popleft().get())
+                while pending:
+                    self.add_counts(*pending.popleft().get())
+        else:
+            for counters in map(_count_batch, batches()):
+                self.add_counts(*counters)
+        logging.info("Evaluated %s streamed examples", n_sents)
+
+    def finalize(self):
+        """
+        Compute precision, recall and f1 from the accumulated counters
+        """
+        self.results, self.evaluation_agg_entities_type = self.partial()
+        return self.results, self.evaluation_agg_entities_type
 
-        for true_ents, pred_ents in zip(self.true, self.pred):
-            # Check that the length of the true and predicted examples are the
-            # same. This must be checked here, because another error may not
-            # be thrown if the lengths do not match.
+    def merge(self, other):
+        """
+        Add the counters of another Evaluator on the same tags, e.g. one which
+        evaluated another shard of the corpus in a separate process
+
+        Integer counts are exact, but the ent_type_weighted sums of both are
+        added at once, so they can differ in the last digits from a serial
+        evaluation of the shards.
+        """
+        if other.types != self.types or (other.repeats != self.repeats).any():
+            raise ValueError("Cannot merge evaluators of different tags")
+        # The counters of other are already repeated
+        self.counts += other.counts
+        self.weighted = self.weighted + other.weighted
+        self.is_weighted |= other.is_weighted
+        return self
+
+    def add_counts(self, counts, weighted, is_weighted):
+        """
+        Accumulate raw counters
+
+        :param counts: (types + 1, schemas, counts) integer counters
+        :param weighted: (sentences, types + 1, 3) ent_type_weighted values of
+            each sentence, summed in order as floats are not associative
+        :param is_weighted: (types + 1,) rows where a similarity was counted
+        """
+        n_repeats = self.repeats.max()
+        if n_repeats > 1:
+            counts = counts * self.repeats[:, np.newaxis, np.newaxis]
+            # The values of each sentence are added as many times in a row as
+            # the type of the row is repeated, zeros being added to the rows
+            # repeated fewer times
+            copies = np.arange(n_repeats)[:, np.newaxis] < self.repeats
+            weighted = (
+                np.repeat(weighted, n_repeats, axis=0)
+                * np.tile(copies, (len(weighted), 1))[..., np.newaxis]
+            )
+        self.counts += counts
+        if len(weighted):
+            weighted = np.concatenate([self.weighted[np.newaxis], weighted])
+            self.weighted = np.add.accumulate(weighted, axis=0)[-1]
+        self.is_weighted |= is_weighted
+
+    def partial(self):
+        """
+        Return the results for the sentences evaluated so far, with precision,
+        recall and f1 computed from the current counts
+        """
+        return counters_to_results(
+            self.counts, self.weighted, self.is_weighted, self.types
+        )
 
-            if len(true_ents) != len(pred_ents):
-                raise ValueError("Prediction length does not match true example length")
 
-            # Compute results for one message
-            tmp_results, tmp_agg_results = compute_metrics(
-                collect_named_entities(true_ents),
-                collect_named_entities(pred_ents),
-                self.tags,
-            )
+def count_batch(true, pred, tags, engine="python"):
+    """
+    Compute the raw counters of a batch of sentences with the given engine
+    """
+    if len(true) != len(pred):
+        raise ValueError("Number of predicted does not equal true")
+    if engine == "numpy":
+        return count_matches(true, pred, tags)
+    return count_sentences(true, pred, tags)
 
-            # Cycle through each result and accumulate
-            for eval_schema in self.results:
-                for metric in self.results[eval_schema]:
-                    self.results[eval_schema][metric] += tmp_results[eval_schema][
-                        metric
-                    ]
-
-            # Calculate global precision and recall
-            self.results = compute_precision_recall(self.results)
-
-            # Aggregate results by entity type
-            for e_type in self.tags:
-                for eval_schema in tmp_agg_results[e_type]:
-                    for metric in tmp_agg_results[e_type][eval_schema]:
-                        self.evaluation_agg_entities_type[e_type][eval_schema][
-                            metric
-                        ] += tmp_agg_results[e_type][eval_schema][metric]
-
-                # Calculate precision recall at the individual entity level
-                self.evaluation_agg_entities_type[e_type] = compute_precision_recall(
-                    self.evaluation_agg_entities_type[e_type]
-                )
 
-        return self.results, self.evaluation_agg_entities_type
+def _count_batch(args):
+    # Helpers for Pool.imap, which passes one argument
+    return count_batch(*args)
+
+
+def _count_label_ids(args):
+    return count_label_ids(*args)
+
+
+def count_sentences(true, pred, tags):
+    """
+    Compute the raw counters of all evaluation schemas with count_entities,
+    sentence by sentence; same output as span_matching.count_matches
+    """
+    n_rows = len(dict.fromkeys(tags)) + 1
+    counts = []
+    weighted = []
+    is_weighted = [False] * n_rows
+    for true_ents, pred_ents in zip(true, pred):
+        # Check that the length of the true and predicted examples are the
+        # same. This must be checked here, because another error may not be
+        # thrown if the lengths do not match.
+
+        if len(true_ents) != len(pred_ents):
+            raise ValueError("Prediction length does not match true example length")
+
+        # Compute results for one message
+        sent_counts, sent_weighted = count_entities(
+            collect_named_entities(true_ents),
+            collect_named_entities(pred_ents),
+            tags,
+        )
+        counts.append(sent_counts)
+        weighted.append(sent_weighted)
+        for row, value in enumerate(sent_weighted):
+            is_weighted[row] = is_weighted[row] or isinstance(value, float)
+
+    counts = np.array(counts, dtype=np.int64)
+    counts = counts.reshape(-1, n_rows, len(SCHEMAS), len(COUNTS))
+    # ent_type_weighted correct, possible and actual of each sentence, as
+    # compute_actual_possible would compute them
+    etw = counts[:, :, SCHEMAS.index("ent_type_weighted")]
+    incorrect, partial, missed, spurious = np.moveaxis(etw[:, :, 1:], -1, 0)
+    correct = np.array(weighted, dtype=np.float64).reshape(-1, n_rows)
+    possible = correct + incorrect + missed + partial
+    actual = correct + incorrect + spurious + partial
+    weighted = np.stack([correct, possible, actual], axis=-1)
+    return SpanCounts(counts.sum(axis=0), weighted, np.array(is_weighted))
+
+
+def counters_to_results(counts, weighted, is_weighted, tags):
+    """
+    Convert raw counters (see Evaluator.add_counts) to the nested dicts
+    returned by Evaluator.evaluate
+    """
+    rows = []
+    for row in range(len(counts)):
+        evaluation = {}
+        for s, eval_schema in enumerate(SCHEMAS):
+            correct, incorrect, partial, missed, spurious = counts[row, s].tolist()
+            evaluation[eval_schema] = {
+                "correct": correct,
+                "incorrect": incorrect,
+                "partial": partial,
+                "missed": missed,
+                "spurious": spurious,
+                "possible": correct + incorrect + missed + partial,
+                "actual": correct + incorrect + spurious + partial,
+                "precision": 0,
+                "recall": 0,
+                "f1": 0,
+            }
+        if is_weighted[row]:
+            evaluation["ent_type_weighted"].update(
+                zip(WEIGHTED, weighted[row].tolist())
+            )
+        rows.append(compute_precision_recall(evaluation))
+    return rows[0], dict(zip(tags, rows[1:]))
 
 
 def collect_named_entities(tokens):
@@ -154,29 +371,42 @@ def sim_ratio(a, b):
     return SequenceMatcher(None, a, b).ratio()
 
 
+# Order of the schemas in the results of compute_metrics
+EVAL_SCHEMAS = ("strict", "strict_weak", "ent_type", "ent_type_weighted", "exact")
+
+
 def compute_metrics(true_named_entities, pred_named_entities, tags):
-    eval_metrics = {
-        "correct": 0,
-        "incorrect": 0,
-        "partial": 0,
-        "missed": 0,
-        "spurious": 0,
-        "precision": 0,
-        "recall": 0,
-        "f1": 0,
-    }
-
-    # overall results
-    evaluation = {
-        "strict": deepcopy(eval_metrics),
-        "strict_weak": deepcopy(eval_metrics),
-        "ent_type": deepcopy(eval_metrics),
-        "ent_type_weighted": deepcopy(eval_metrics),
-        "exact": deepcopy(eval_metrics),
-    }
-
-    # results by entity type
-    evaluation_agg_entities_type = {e: deepcopy(evaluation) for e in tags}
+    """
+    Return the results of one sentence as nested dicts, overall and by entity
+    type, built from the counters of count_entities
+    """
+    counts, weighted = count_entities(true_named_entities, pred_named_entities, tags)
+    rows = []
+    for row, row_counts in enumerate(counts.tolist()):
+        evaluation = {}
+        for eval_schema in EVAL_SCHEMAS:
+            metrics = dict(zip(COUNTS, row_counts[SCHEMAS.index(eval_schema)]))
+            if eval_schema == "ent_type_weighted":
+                metrics["correct"] = weighted[row]
+            metrics.update(precision=0, recall=0, f1=0)
+            evaluation[eval_schema] = compute_actual_possible(metrics)
+        rows.append(evaluation)
+    return rows[0], dict(zip(dict.fromkeys(tags), rows[1:]))
+
+
+def count_entities(true_named_entities, pred_named_entities, tags):
+    """
+    Match the true and predicted entities of one sentence and count the
+    outcomes for each evaluation schema
+
+    :return: a (types + 1, schemas, counts) integer array, where the first
+        row holds the overall counts and the other ones the counts by entity
+        type, and the ent_type_weighted correct value of each row (see
+        span_matching.PATTERNS)
+    """
+    rows = {e: i + 1 for i, e in enumerate(dict.fromkeys(tags))}
+    counts = np.zeros((len(rows) + 1, len(SCHEMAS), len(COUNTS)), dtype=np.int64)
+    weighted = [0] * (len(rows) + 1)
 
     # Subset into only the tags that we are interested in.
     # NOTE: we remove the tags we don't want from both the predicted and the
@@ -185,37 +415,25 @@ def compute_metrics(true_named_entities, pred_named_entities, tags):
     # 1) Where the model predicts a tag that is not present in the true data
     # 2) Where there is a tag in the true data that the model is not capable of
     # predicting.
-    true_named_entities = [ent for ent in true_named_entities if ent.e_type in tags]
-    pred_named_entities = [ent for ent in pred_named_entities if ent.e_type in tags]
+    true_named_entities = [ent for ent in true_named_entities if ent.e_type in rows]
+    pred_named_entities = [ent for ent in pred_named_entities if ent.e_type in rows]
 
     # keep track of entities that overlapped
     true_which_overlapped_with_pred = []
 
     # go through each predicted named-entity
     for pred in pred_named_entities:
-        found_overlap = False
         # Check each of the potential scenarios in turn. See
         # http://www.davidsbatista.net/blog/2018/05/09/Named_Entity_Evaluation/
         # for scenario explanation.
+        outcome = None
 
         # Scenario I: Exact match between true and pred
         if pred in true_named_entities:
             true_which_overlapped_with_pred.append(pred)
-
-            evaluation["strict"]["correct"] += 1
-            evaluation["strict_weak"]["correct"] += 1
-            evaluation["exact"]["correct"] += 1
-            evaluation["ent_type"]["correct"] += 1
-            evaluation["ent_type_weighted"]["correct"] += 1
-
-            # for the agg. by e_type results
-            evaluation_agg_entities_type[pred.e_type]["strict"]["correct"] += 1
-            evaluation_agg_entities_type[pred.e_type]["strict_weak"]["correct"] += 1
-            evaluation_agg_entities_type[pred.e_type]["exact"]["correct"] += 1
-            evaluation_agg_entities_type[pred.e_type]["ent_type"]["correct"] += 1
-            evaluation_agg_entities_type[pred.e_type]["ent_type_weighted"][
-                "correct"
-            ] += 1
+            outcome = type_outcome = EXACT
+            e_type = pred.e_type
+            weight = 1
         else:
             # check for overlaps with any of the true entities
             for true in true_named_entities:
@@ -228,157 +446,52 @@ def compute_metrics(true_named_entities, pred_named_entities, tags):
                     and pred.end_offset == true.end_offset
                     and true.e_type != pred.e_type
                 ):
-
-                    # overall results
-                    evaluation["strict"]["incorrect"] += 1
-                    evaluation["exact"]["correct"] += 1
-                    if pred.e_type == "Artist_or_WoA":
-                        evaluation["strict_weak"]["partial"] += 1
-                        evaluation["ent_type"]["partial"] += 1
-                        evaluation["ent_type_weighted"]["partial"] += 1
-
-                    else:
-                        evaluation["strict_weak"]["partial"] += 1
-                        evaluation["ent_type"]["incorrect"] += 1
-                        evaluation["ent_type_weighted"]["incorrect"] += 1
-
-                    # aggregated by entity type results
-                    evaluation_agg_entities_type[true.e_type]["strict"][
-                        "incorrect"
-                    ] += 1
-                    evaluation_agg_entities_type[true.e_type]["exact"]["correct"] += 1
-                    if pred.e_type == "Artist_or_WoA":
-                        evaluation_agg_entities_type[true.e_type]["strict_weak"][
-                            "partial"
-                        ] += 1
-                        evaluation_agg_entities_type[true.e_type]["ent_type"][
-                            "partial"
-                        ] += 1
-                        evaluation_agg_entities_type[true.e_type]["ent_type_weighted"][
-                            "partial"
-                        ] += 1
+                    if pred.e_type == AOW:
+                        outcome = type_outcome = SWAPPED_AOW
                     else:
-                        evaluation_agg_entities_type[true.e_type]["strict_weak"][
-                            "incorrect"
-                        ] += 1
-                        evaluation_agg_entities_type[true.e_type]["ent_type"][
-                            "incorrect"
-                        ] += 1
-                        evaluation_agg_entities_type[true.e_type]["ent_type_weighted"][
-                            "incorrect"
-                        ] += 1
-
-                    true_which_overlapped_with_pred.append(true)
-                    found_overlap = True
-                    break
+                        outcome, type_outcome = SWAPPED, SWAPPED_TYPE
 
                 # check for an overlap i.e. not exact boundary match, with true entities
                 elif find_overlap(true_range, pred_range) and (
-                    pred.e_type == true.e_type or pred.e_type == "Artist_or_WoA"
+                    pred.e_type == true.e_type or pred.e_type == AOW
                 ):
                     # Make sure not to count this true entity twice
                     # This could happen if for this true entity there are multiple predictions that overlap
                     if true in true_which_overlapped_with_pred:
-                        # print(true, pred)
                         continue
 
-                    # overall results
-                    evaluation["strict"]["incorrect"] += 1
-                    evaluation["strict_weak"]["incorrect"] += 1
-                    evaluation["exact"]["incorrect"] += 1
-
                     if pred.e_type == true.e_type:
-                        evaluation["ent_type"]["correct"] += 1
-                        evaluation["ent_type_weighted"]["correct"] += sim_ratio(
-                            true_range, pred_range
-                        )
-                    elif pred.e_type == "Artist_or_WoA":
-                        evaluation["ent_type"]["partial"] += 1
-                        evaluation["ent_type_weighted"]["partial"] += 1
-
-                    # aggregated by entity type results
-                    evaluation_agg_entities_type[true.e_type]["strict"][
-                        "incorrect"
-                    ] += 1
-                    evaluation_agg_entities_type[true.e_type]["strict_weak"][
-                        "incorrect"
-                    ] += 1
-                    evaluation_agg_entities_type[true.e_type]["exact"]["incorrect"] += 1
+                        outcome = type_outcome = OVERLAP
+                        weight = sim_ratio(true_range, pred_range)
+                    else:
+                        outcome = type_outcome = OVERLAP_AOW
 
-                    if pred.e_type == true.e_type:
-                        evaluation_agg_entities_type[true.e_type]["ent_type"][
-                            "correct"
-                        ] += 1
-                        evaluation_agg_entities_type[true.e_type]["ent_type_weighted"][
-                            "correct"
-                        ] += sim_ratio(true_range, pred_range)
-                    elif pred.e_type == "Artist_or_WoA":
-                        evaluation_agg_entities_type[true.e_type]["ent_type"][
-                            "partial"
-                        ] += 1
-                        evaluation_agg_entities_type[true.e_type]["ent_type_weighted"][
-                            "partial"
-                        ] += 1
-
-                    true_which_overlapped_with_pred.append(true)
-                    found_overlap = True
-                    break
-
-            if not found_overlap:
-                # Overall results
-                evaluation["strict"]["spurious"] += 1
-                evaluation["strict_weak"]["spurious"] += 1
-                evaluation["ent_type"]["spurious"] += 1
-                evaluation["ent_type_weighted"]["spurious"] += 1
-                evaluation["exact"]["spurious"] += 1
-
-                # Aggregated by entity type results
-                ptype = pred.e_type
-                evaluation_agg_entities_type[ptype]["strict"]["spurious"] += 1
-                evaluation_agg_entities_type[ptype]["strict_weak"]["spurious"] += 1
-                evaluation_agg_entities_type[ptype]["ent_type"]["spurious"] += 1
-                evaluation_agg_entities_type[ptype]["ent_type_weighted"][
-                    "spurious"
-                ] += 1
-                evaluation_agg_entities_type[ptype]["exact"]["spurious"] += 1
+                else:
+                    continue
+
+                # aggregated by the true entity type
+                e_type = true.e_type
+                true_which_overlapped_with_pred.append(true)
+                break
+
+        if outcome is None:
+            # Aggregated by the predicted entity type
+            outcome = type_outcome = SPURIOUS
+            e_type = pred.e_type
+
+        counts[0] += PATTERNS[outcome]
+        counts[rows[e_type]] += PATTERNS[type_outcome]
+        if outcome in (EXACT, OVERLAP):
+            weighted[0] += weight
+            weighted[rows[e_type]] += weight
 
     # Scenario III: Entity was missed entirely.
     for true in true_named_entities:
-        # if true not in pred_named_entities:
-        if true in true_which_overlapped_with_pred:
-            continue
-        else:
-            # overall results
-            evaluation["strict"]["missed"] += 1
-            evaluation["strict_weak"]["missed"] += 1
-            evaluation["ent_type"]["missed"] += 1
-            evaluation["ent_type_weighted"]["missed"] += 1
-            evaluation["exact"]["missed"] += 1
-
-            # for the agg. by e_type
-            evaluation_agg_entities_type[true.e_type]["strict"]["missed"] += 1
-            evaluation_agg_entities_type[true.e_type]["strict_weak"]["missed"] += 1
-            evaluation_agg_entities_type[true.e_type]["ent_type"]["missed"] += 1
-            evaluation_agg_entities_type[true.e_type]["ent_type_weighted"][
-                "missed"
-            ] += 1
-            evaluation_agg_entities_type[true.e_type]["exact"]["missed"] += 1
-
-    # Compute 'possible', 'actual' according to SemEval-2013 Task 9.1 on the
-    # overall results, and use these to calculate precision and recall.
-    for eval_type in evaluation:
-        evaluation[eval_type] = compute_actual_possible(evaluation[eval_type])
-
-    # Compute 'possible', 'actual', and precision and recall on entity level
-    # results. Start by cycling through the accumulated results.
-    for entity_type, entity_level in evaluation_agg_entities_type.items():
-        # Cycle through the evaluation types for each dict containing entity
-        # level results.
-        for eval_type in entity_level:
-            evaluation_agg_entities_type[entity_type][
-                eval_type
-            ] = compute_actual_possible(entity_level[eval_type])
-    return evaluation, evaluation_agg_entities_type
+        if true not in true_which_overlapped_with_pred:
+            counts[0] += PATTERNS[MISSED]
+            counts[rows[true.e_type]] += PATTERNS[MISSED]
+
+    return counts, weighted
 
 
 def find_overlap(true_range, pred_range):
@@ -0,0 +1,271 @@
+"""
+Export a checkpoint fine-tuned with fine-tune.py to ONNX and tag queries with
+ONNX Runtime on CPU
+
+The exported graph takes the tokenizer outputs, with dynamic batch and
+sequence axes, and returns the token logits. OnnxQueryTagger decodes them as
+QueryTagger does, keeping the prediction of the first sub-token of each word
+like fine-tune.py does with the -100 labels. Run this file to export a model,
+check that its outputs match the PyTorch ones and benchmark both backends on
+the test sets.
+
+ONNX Runtime is an optional dependency: pip install onnxruntime
+"""
+
+import argparse
+import inspect
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+from tabulate import tabulate
+from tag_queries import QueryTagger, label_names, load_tokenizer
+from transformers import AutoConfig
+
+sys.path.append("music-ner/datasets")
+from bio_io import BioCorpus
+
+ONNX_MODEL = "model.onnx"
+
+
+def export_onnx(model_dir, output_dir, opset_version=14):
+    """
+    Export the model of a checkpoint to ONNX, with its config and tokenizer,
+    in output_dir, which can then be loaded with OnnxQueryTagger
+    """
+    tagger = QueryTagger(model_dir)
+    inputs = tagger.pad(tagger.encode([["onnx"], ["onnx", "export"]]), [0, 1])
+    # The graph inputs are named in the order of the arguments of forward
+    input_names = [
+        name
+        for name in inspect.signature(tagger.model.forward).parameters
+        if name in inputs
+    ]
+    kwargs = {}
+    # From torch 2.5, the default exporter (dynamo) ignores dynamic_axes
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        kwargs["dynamo"] = False
+    os.makedirs(output_dir, exist_ok=True)
+    torch.onnx.export(
+        tagger.model,
+        (dict(inputs),),
+        os.path.join(output_dir, ONNX_MODEL),
+        input_names=input_names,
+        output_names=["logits"],
+        dynamic_axes={
+            name: {0: "batch", 1: "sequence"} for name in input_names + ["logits"]
+        },
+        opset_version=opset_version,
+        **kwargs,
+    )
+    tagger.model.config.save_pretrained(output_dir)
+    tagger.tokenizer.save_pretrained(output_dir)
+
+
+class OnnxQueryTagger(QueryTagger):
+    """
+    QueryTagger running a model exported with export_onnx with ONNX Runtime
+    on CPU
+    """
+
+    return_tensors = "np"
+
+    def __init__(self, model_dir, max_seq_length=None, num_threads=None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise ImportError(
+                "The ONNX backend requires onnxruntime: pip install onnxruntime"
+            ) from e
+
+        options = onnxruntime.SessionOptions()
+        if num_threads is not None:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL),
+            options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = [node.name for node in self.session.get_inputs()]
+        config = AutoConfig.from_pretrained(model_dir)
+        self.tokenizer = load_tokenizer(model_dir, config)
+        self.label_names = label_names(config)
+        self.max_seq_length = max_seq_length
+
+    def logits(self, inputs):
+        return self.session.run(
+            ["logits"], {name: inputs[name] for name in self.input_names}
+        )[0]
+
+
+def check_parity(torch_tagger, onnx_tagger, words, batch_size=32):
+    """
+    Compare the outputs of the PyTorch and ONNX backends on sentences
+
+    :return: maximum absolute difference of the logits, and share of the
+        sentences with identical word-level tags
+    """
+    encodings = torch_tagger.encode(words)
+    max_diff = 0.0
+    for b in range(0, len(words), batch_size):
+        batch = range(b, min(b + batch_size, len(words)))
+        diff = np.abs(
+            torch_tagger.logits(torch_tagger.pad(encodings, batch))
+            - onnx_tagger.logits(onnx_tagger.pad(encodings, batch))
+        )
+        max_diff = max(max_diff, float(diff.max()))
+    identical = np.mean(
+        [
+            torch_tags == onnx_tags
+            for torch_tags, onnx_tags in zip(
+                torch_tagger.predict(words, batch_size),
+                onnx_tagger.predict(words, batch_size),
+            )
+        ]
+    )
+    return max_diff, float(identical)
+
+
+def benchmark(tagger, words, batch_size):
+    """
+    Tag the sentences after a warm-up batch
+
+    :return: latency per batch in seconds, and throughput in sentences/s
+    """
+    tagger.predict(words[:batch_size], batch_size)
+    start = time.perf_counter()
+    tagger.predict(words, batch_size)
+    elapsed = time.perf_counter() - start
+    n_batches = -(-len(words) // batch_size)
+    return elapsed / n_batches, len(words) / elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_dir",
+        dest="model_dir",
+        type=str,
+        help="Output directory of fine-tune.py",
+        required=True,
+    )
+    parser.add_argument(
+        "--export_dir",
+        dest="export_dir",
+        type=str,
+        help="Directory where to export the ONNX model",
+        required=True,
+    )
+    parser.add_argument(
+        "--opset_version",
+        dest="opset_version",
+        type=int,
+        help="ONNX opset version",
+        default=14,
+    )
+    parser.add_argument(
+        "--data_dirs",
+        dest="data_dirs",
+        type=str,
+        nargs="*",
+        help="Data directories whose test.bio is used for the parity check and "
+        "the benchmark, none to skip them",
+        default=[f"data/dataset{i}" for i in range(1, 5)],
+    )
+    parser.add_argument(
+        "--batch_sizes",
+        dest="batch_sizes",
+        type=int,
+        nargs="+",
+        help="Batch sizes of the benchmark",
+        default=[1, 8, 64],
+    )
+    parser.add_argument(
+        "--atol",
+        dest="atol",
+        type=float,
+        help="Maximum absolute difference of the logits accepted by the parity check",
+        default=1e-4,
+    )
+    parser.add_argument(
+        "--num_threads",
+        dest="num_threads",
+        type=int,
+        help="Number of CPU threads used by torch and ONNX Runtime",
+        default=None,
+    )
+    parser.add_argument(
+        "--output_file",
+        dest="output_file",
+        type=str,
+        help="json file where to save the report",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    export_onnx(args.model_dir, args.export_dir, args.opset_version)
+    print(f"ONNX model exported to {args.export_dir}")
+    if not args.data_dirs:
+        sys.exit(0)
+
+    taggers = {
+        "torch": QueryTagger(args.model_dir),
+        "onnx": OnnxQueryTagger(args.export_dir, num_threads=args.num_threads),
+    }
+
+    report = {}
+    parity_table = []
+    benchmark_table = []
+    passed = True
+    for data_dir in args.data_dirs:
+        corpus = BioCorpus.read(f"{data_dir}/test.bio")
+        words = [list(tokens) for tokens, _ in corpus]
+        max_diff, identical = check_parity(taggers["torch"], taggers["onnx"], words)
+        passed = passed and max_diff <= args.atol and identical == 1
+        report[data_dir] = {
+            "parity": {"max_abs_diff": max_diff, "identical_tags": identical}
+        }
+        parity_table.append([data_dir, f"{max_diff:.2e}", f"{identical:.4f}"])
+
+        for batch_size in args.batch_sizes:
+            for name, tagger in taggers.items():
+                latency, throughput = benchmark(tagger, words, batch_size)
+                report[data_dir][f"{name}_bs{batch_size}"] = {
+                    "latency_ms": latency * 1000,
+                    "queries_per_s": throughput,
+                }
+                benchmark_table.append(
+                    [
+                        data_dir,
+                        name,
+                        batch_size,
+                        f"{latency * 1000:.2f}",
+                        f"{throughput:.1f}",
+                    ]
+                )
+
+    print(
+        tabulate(
+            parity_table,
+            headers=["data", "max |logits diff|", "identical tags"],
+        )
+    )
+    print()
+    print(
+        tabulate(
+            benchmark_table,
+            headers=["data", "backend", "batch size", "ms/batch", "queries/s"],
+        )
+    )
+    if args.output_file is not None:
+        with open(args.output_file, "w") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+    if not passed:
+        print(f"Parity check failed (atol={args.atol})")
+        sys.exit(1)
@@ -0,0 +1,163 @@
+"""
+Export a checkpoint fine-tuned with fine-tune.py with its Linear layers
+dynamically quantized to int8, and compare the quantized and the full
+precision models on the test sets: F1 per entity type and schema computed
+with compute_results, and CPU latency
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import torch
+from eval_utils import compute_results
+from tabulate import tabulate
+from tag_queries import QUANTIZED_WEIGHTS, QueryTagger
+
+sys.path.append("music-ner/datasets")
+from bio_io import BioCorpus
+
+ENT_TYPES = ["Artist", "WoA"]
+EVAL_SCHEMAS = ["strict", "exact", "ent_type"]
+
+
+def export_quantized(model_dir, output_dir):
+    """
+    Save the quantized weights, the config and the tokenizer of a checkpoint
+    in output_dir, which can then be loaded with QueryTagger
+    """
+    tagger = QueryTagger(model_dir, quantize=True)
+    os.makedirs(output_dir, exist_ok=True)
+    torch.save(tagger.model.state_dict(), os.path.join(output_dir, QUANTIZED_WEIGHTS))
+    tagger.model.config.save_pretrained(output_dir)
+    tagger.tokenizer.save_pretrained(output_dir)
+
+
+def weights_size(model):
+    """
+    Size in MB of the serialized weights of a model
+    """
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.tell() / 2**20
+
+
+def evaluate(tagger, words, labels, batch_size):
+    """
+    Tag the sentences and return the F1 scores and the latency per sentence
+    """
+    start = time.perf_counter()
+    predictions = tagger.predict(words, batch_size)
+    latency = (time.perf_counter() - start) / len(words)
+    # compute_results prints the detailed results, only the F1 are reported
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = compute_results(
+            labels, predictions, ent_types=ENT_TYPES, eval_schemas=EVAL_SCHEMAS
+        )
+    scores = {
+        f"{ent_type}_{schema}_f1": results[f"{ent_type}_{schema}_f1"]
+        for ent_type in ENT_TYPES
+        for schema in EVAL_SCHEMAS
+    }
+    return scores, latency
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_dir",
+        dest="model_dir",
+        type=str,
+        help="Output directory of fine-tune.py",
+        required=True,
+    )
+    parser.add_argument(
+        "--export_dir",
+        dest="export_dir",
+        type=str,
+        help="Directory where to export the quantized model",
+        default=None,
+    )
+    parser.add_argument(
+        "--data_dirs",
+        dest="data_dirs",
+        type=str,
+        nargs="*",
+        help="Data directories whose test.bio is used for the report, none to skip it",
+        default=[f"data/dataset{i}" for i in range(1, 5)],
+    )
+    parser.add_argument(
+        "--batch_size", dest="batch_size", type=int, help="Batch size", default=32
+    )
+    parser.add_argument(
+        "--num_threads",
+        dest="num_threads",
+        type=int,
+        help="Number of CPU threads used by torch",
+        default=None,
+    )
+    parser.add_argument(
+        "--output_file",
+        dest="output_file",
+        type=str,
+        help="json file where to save the report",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    if args.export_dir is not None:
+        export_quantized(args.model_dir, args.export_dir)
+        print(f"Quantized model exported to {args.export_dir}")
+    if not args.data_dirs:
+        sys.exit(0)
+
+    reference = QueryTagger(args.model_dir)
+    # The reference is named after the weights actually loaded: a directory
+    # exported by this script holds int8 weights only
+    reference_name = "int8 reference" if reference.quantized else "fp32"
+    if reference.quantized:
+        print(f"{args.model_dir} holds {QUANTIZED_WEIGHTS}, the reference is int8")
+    taggers = {
+        reference_name: reference,
+        "int8": QueryTagger(args.export_dir or args.model_dir, quantize=True),
+    }
+    for name, tagger in taggers.items():
+        print(f"{name} weights: {weights_size(tagger.model):.1f} MB")
+
+    report = {}
+    table = []
+    for data_dir in args.data_dirs:
+        corpus = BioCorpus.read(f"{data_dir}/test.bio")
+        words = [list(tokens) for tokens, _ in corpus]
+        labels = corpus.tag_lists()
+        report[data_dir] = {}
+        for name, tagger in taggers.items():
+            scores, latency = evaluate(tagger, words, labels, args.batch_size)
+            report[data_dir][name] = {"latency_ms": latency * 1000, **scores}
+            reference_scores = report[data_dir][reference_name]
+            table.append(
+                [data_dir, name, f"{latency * 1000:.2f}"]
+                + [
+                    (
+                        f"{value:.4f}"
+                        if name == reference_name
+                        else f"{value:.4f} ({value - reference_scores[key]:+.4f})"
+                    )
+                    for key, value in scores.items()
+                ]
+            )
+
+    headers = ["data", "model", "ms/query"] + [
+        f"{ent_type} {schema} F1" for ent_type in ENT_TYPES for schema in EVAL_SCHEMAS
+    ]
+    print(tabulate(table, headers=headers))
+    if args.output_file is not None:
+        with open(args.output_file, "w") as f:
+            json.dump(report, f, indent=4, sort_keys=True)
@@ -0,0 +1,25 @@
+"""
+Reading of raw queries, shared by tag_queries.py and tagging_client.py
+without importing torch or transformers
+"""
+
+import csv
+import sys
+
+
+def read_queries(input_file, text_column="preprocessed"):
+    """
+    Yield queries one by one from a csv file (text_column column), a text
+    file with one query per line, or stdin if input_file is "-"
+    """
+    if input_file == "-":
+        for line in sys.stdin:
+            yield line.rstrip("\n")
+    elif input_file.endswith(".csv"):
+        with open(input_file, newline="") as _:
+            for row in csv.DictReader(_):
+                yield row[text_column]
+    else:
+        with open(input_file, "r") as _:
+            for line in _:
+                yield line.rstrip("\n")
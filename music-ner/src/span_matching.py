@@ -0,0 +1,347 @@
+"""
+Vectorized span-matching engine for the evaluation schemas of ner_eval
+
+All the gold and predicted entities of a corpus are encoded into flat NumPy
+arrays (sentence id, type id, start offset, end offset) and matched with sorted
+joins and interval arithmetic, instead of comparing Entity named-tuples
+sentence by sentence. The counters produced are the same as the ones
+accumulated from ner_eval.compute_metrics, including the order in which the
+similarity ratios of the ent_type_weighted schema are summed.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+
+SCHEMAS = ("strict", "strict_weak", "exact", "ent_type", "ent_type_weighted")
+COUNTS = ("correct", "incorrect", "partial", "missed", "spurious")
+WEIGHTED = ("correct", "possible", "actual")
+
+AOW = "Artist_or_WoA"
+
+# Spans of one corpus; start and end are inclusive positions in the flat
+# token array, hence spans never cross sentences and are unique by start
+Spans = namedtuple("Spans", "sent e_type start end")
+
+# Raw counters of one corpus (see match_spans)
+SpanCounts = namedtuple("SpanCounts", "counts weighted is_weighted")
+
+# Outcome of the matching for one entity, which defines how it is counted
+EXACT = 0  # Scenario I: exact match between true and pred
+SWAPPED_AOW = 1  # Scenario IV: offsets match, Artist_or_WoA predicted
+SWAPPED = 2  # Scenario IV: offsets match, entity type is wrong
+SWAPPED_TYPE = 3  # Scenario IV, aggregated by true entity type
+OVERLAP = 4  # Boundaries overlap, same entity type
+OVERLAP_AOW = 5  # Boundaries overlap, Artist_or_WoA predicted
+SPURIOUS = 6  # The predicted entity does not exist
+MISSED = 7  # Scenario III: entity was missed entirely
+
+
+def _pattern(*cells):
+    pattern = np.zeros((len(SCHEMAS), len(COUNTS)), dtype=np.int64)
+    for schema, metric in zip(SCHEMAS, cells):
+        pattern[SCHEMAS.index(schema), COUNTS.index(metric)] = 1
+    return pattern
+
+
+# Increments applied to the (schema, count) counters for each outcome. For
+# OVERLAP, ent_type_weighted correct is incremented by the similarity ratio of
+# the two spans; the integer counter holds the number of such matches and the
+# weighted sum is kept aside in the weighted counters.
+PATTERNS = np.stack(
+    [
+        _pattern("correct", "correct", "correct", "correct", "correct"),
+        _pattern("incorrect", "partial", "correct", "partial", "partial"),
+        _pattern("incorrect", "partial", "correct", "incorrect", "incorrect"),
+        _pattern("incorrect", "incorrect", "correct", "incorrect", "incorrect"),
+        _pattern("incorrect", "incorrect", "incorrect", "correct", "correct"),
+        _pattern("incorrect", "incorrect", "incorrect", "partial", "partial"),
+        _pattern("spurious", "spurious", "spurious", "spurious", "spurious"),
+        _pattern("missed", "missed", "missed", "missed", "missed"),
+    ]
+)
+
+
+def encode_tags(sequences):
+    """
+    Encode sequences of tags as a flat array of tag ids
+
+    :param sequences: a list of lists of tags
+    :return: sequence lengths, flat tag ids and the list of distinct tags
+    """
+    vocab = {}
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    ids = [vocab.setdefault(tag, len(vocab)) for seq in sequences for tag in seq]
+    return lengths, np.asarray(ids, dtype=np.int64), list(vocab)
+
+
+def collect_spans(lengths, tag_ids, vocab, tags):
+    """
+    Vectorized equivalent of ner_eval.collect_named_entities over a corpus
+
+    Entities whose type is not in tags are decoded, so that they still
+    delimit their neighbours, then dropped.
+
+    :param lengths: number of tokens of each sentence
+    :param tag_ids: flat array of tag ids for all the tokens of the corpus
+    :param vocab: the tags corresponding to the ids
+    :param tags: entity types of interest, their index is the span type id
+    :return: a Spans named-tuple
+    """
+    type_ids = {e_type: i for i, e_type in enumerate(tags)}
+    for tag in vocab:
+        type_ids.setdefault(tag[2:], len(type_ids))
+    is_o = np.array([tag == "O" for tag in vocab] + [True])
+    is_b = np.array([tag[:1] == "B" for tag in vocab] + [False])
+    e_type = np.array([type_ids[tag[2:]] for tag in vocab] + [-1], dtype=np.int64)
+
+    n = len(tag_ids)
+    offsets = np.cumsum(lengths) - lengths
+    first = np.zeros(n + 1, dtype=bool)
+    first[offsets[lengths > 0]] = True
+    first[n] = True
+
+    # pad with an "O" token on both sides so that neighbours always exist
+    padded = np.concatenate(([len(vocab)], tag_ids, [len(vocab)]))
+    tok_o = is_o[padded]
+    tok_type = e_type[padded]
+    # a new entity starts after an "O", on a type change, or on a "B" tag
+    starts = ~tok_o[1:-1] & (
+        first[:-1] | tok_o[:-2] | (tok_type[1:-1] != tok_type[:-2]) | is_b[padded[1:-1]]
+    )
+    is_start = np.append(starts, True)
+    ends = ~tok_o[1:-1] & (first[1:] | tok_o[2:] | is_start[1:])
+
+    start = np.flatnonzero(starts)
+    end = np.flatnonzero(ends)
+    span_type = tok_type[start + 1]
+    keep = span_type < len(tags)
+    start = start[keep]
+    return Spans(
+        sent=np.searchsorted(offsets, start, side="right") - 1,
+        e_type=span_type[keep],
+        start=start,
+        end=end[keep],
+    )
+
+
+def _overlap_pairs(gold, pred, candidates):
+    """
+    Return all (pred, gold) pairs whose ranges overlap, for the given preds
+
+    As in ner_eval.find_overlap, the ranges exclude the end offset.
+    """
+    non_empty = np.flatnonzero(gold.start < gold.end)
+    candidates = candidates[pred.start[candidates] < pred.end[candidates]]
+    lo = np.searchsorted(gold.end[non_empty], pred.start[candidates], side="right")
+    hi = np.searchsorted(gold.start[non_empty], pred.end[candidates], side="left")
+    n_pairs = np.maximum(hi - lo, 0)
+    pair_pred = np.repeat(candidates, n_pairs)
+    first_pair = np.cumsum(n_pairs) - n_pairs
+    rank = np.arange(len(pair_pred)) - np.repeat(first_pair, n_pairs)
+    pair_gold = non_empty[np.repeat(lo, n_pairs) + rank]
+    return pair_pred, pair_gold
+
+
+def _claim(gold, pred, pair_pred, pair_gold):
+    """
+    Assign at most one overlapping gold entity to each prediction
+
+    compute_metrics gives each prediction the first true entity, in sentence
+    order, which was not already taken by a previous prediction. A gold entity
+    can only be shared by two consecutive predictions, so the greedy pass is
+    only replayed for the (rare) sentences where this happens.
+    """
+    claims = np.full(len(pred.start), -1, dtype=np.int64)
+    shared = np.bincount(pair_gold, minlength=len(gold.start))[pair_gold] > 1
+    greedy = np.isin(pred.sent[pair_pred], pred.sent[pair_pred[shared]])
+
+    preds, first = np.unique(pair_pred[~greedy], return_index=True)
+    claims[preds] = pair_gold[~greedy][first]
+
+    claimed = set()
+    for p, g in zip(pair_pred[greedy].tolist(), pair_gold[greedy].tolist()):
+        if claims[p] == -1 and g not in claimed:
+            claims[p] = g
+            claimed.add(g)
+    return claims
+
+
+def match_spans(gold, pred, n_types, aow=-1):
+    """
+    Match predicted to gold spans and count the outcomes for each schema
+
+    :param gold: Spans of the true entities
+    :param pred: Spans of the predicted entities, on the same tokens
+    :param n_types: number of entity types of interest
+    :param aow: type id of Artist_or_WoA, -1 if it is not evaluated
+    :return: a SpanCounts named-tuple with
+        counts: (n_types + 1, schemas, counts) integer counters; the first row
+            holds the overall results, the others the results by entity type
+        weighted: (sentences with entities, n_types + 1, 3) per-sentence
+            correct, possible and actual values of ent_type_weighted, in
+            sentence order, to be summed as compute_metrics results are
+        is_weighted: (n_types + 1,) rows where a similarity ratio was counted
+    """
+    n_pred = len(pred.start)
+    n_gold = len(gold.start)
+
+    # Scenario I and IV: join on the start offset, which is unique
+    same_bounds = np.zeros(n_pred, dtype=bool)
+    pos = np.zeros(n_pred, dtype=np.int64)
+    if n_gold:
+        pos = np.minimum(np.searchsorted(gold.start, pred.start), n_gold - 1)
+        same_bounds = (gold.start[pos] == pred.start) & (gold.end[pos] == pred.end)
+    exact = same_bounds.copy()
+    exact[same_bounds] = gold.e_type[pos[same_bounds]] == pred.e_type[same_bounds]
+    swapped = same_bounds & ~exact
+
+    # Overlaps with compatible entity types
+    pair_pred, pair_gold = _overlap_pairs(gold, pred, np.flatnonzero(~same_bounds))
+    compatible = (gold.e_type[pair_gold] == pred.e_type[pair_pred]) | (
+        pred.e_type[pair_pred] == aow
+    )
+    claims = _claim(gold, pred, pair_pred[compatible], pair_gold[compatible])
+    overlap = claims >= 0
+    spurious = ~same_bounds & ~overlap
+
+    found = np.zeros(n_gold, dtype=bool)
+    found[pos[same_bounds]] = True
+    found[claims[overlap]] = True
+    missed = np.flatnonzero(~found)
+
+    # Gold entity matched by each prediction and the type it is counted for
+    matched = np.where(same_bounds, pos, claims)
+    target_type = pred.e_type.copy()
+    target_type[~spurious] = gold.e_type[matched[~spurious]]
+    pred_aow = pred.e_type == aow
+
+    kind = np.full(n_pred, SPURIOUS, dtype=np.int64)
+    kind[exact] = EXACT
+    kind[swapped] = np.where(pred_aow[swapped], SWAPPED_AOW, SWAPPED)
+    is_overlap_aow = pred_aow & (pred.e_type != target_type)
+    kind[overlap] = np.where(is_overlap_aow[overlap], OVERLAP_AOW, OVERLAP)
+    type_kind = np.where(kind == SWAPPED, SWAPPED_TYPE, kind)
+
+    # ent_type_weighted correct increments: 1 for exact matches, similarity
+    # ratio of the ranges for overlaps of the same type
+    weight = exact.astype(np.float64)
+    if overlap.any():
+        p, g = np.flatnonzero(kind == OVERLAP), matched[kind == OVERLAP]
+        common = np.minimum(gold.end[g], pred.end[p]) - np.maximum(
+            gold.start[g], pred.start[p]
+        )
+        length = (gold.end[g] - gold.start[g]) + (pred.end[p] - pred.start[p])
+        weight[p] = 2.0 * common / length
+
+    # one event for the overall results and one for the type results,
+    # predictions first, in order, then missed gold entities
+    sent = np.concatenate([pred.sent, gold.sent[missed]])
+    rows = np.concatenate([target_type + 1, gold.e_type[missed] + 1])
+    kinds = np.concatenate([kind, np.full(len(missed), MISSED, dtype=np.int64)])
+    type_kinds = np.concatenate([type_kind, kinds[n_pred:]])
+    weights = np.concatenate([weight, np.zeros(len(missed))])
+    sent = np.concatenate([sent, sent])
+    rows = np.concatenate([np.zeros_like(rows), rows])
+    kinds = np.concatenate([kinds, type_kinds])
+    weights = np.concatenate([weights, weights])
+
+    n_rows = n_types + 1
+    n_kinds = len(PATTERNS)
+    per_row = np.bincount(rows * n_kinds + kinds, minlength=n_rows * n_kinds)
+    counts = np.einsum("rk,ksc->rsc", per_row.reshape(n_rows, n_kinds), PATTERNS)
+    is_weighted = np.bincount(rows[kinds == OVERLAP], minlength=n_rows) > 0
+
+    weighted = _weighted_by_sentence(sent, rows, kinds, weights, n_rows)
+    return SpanCounts(counts, weighted, is_weighted)
+
+
+def _weighted_by_sentence(sent, rows, kinds, weights, n_rows):
+    """
+    Per-sentence correct, possible and actual values of ent_type_weighted,
+    computed with the same floating point operations as compute_metrics
+    """
+    active, sent = np.unique(sent, return_inverse=True)
+    cell = sent * n_rows + rows
+    n_cells = len(active) * n_rows
+
+    etw = PATTERNS[:, SCHEMAS.index("ent_type_weighted")]
+    counts = {
+        metric: np.bincount(
+            cell, weights=etw[kinds, COUNTS.index(metric)], minlength=n_cells
+        )
+        for metric in ("incorrect", "partial", "missed", "spurious")
+    }
+
+    # sum the increments of each cell sequentially, in prediction order
+    correct = np.zeros(n_cells)
+    order = np.flatnonzero(weights > 0)
+    cells = cell[order]
+    order = order[np.argsort(cells, kind="stable")]
+    cells = cell[order]
+    is_first = np.ones(len(cells), dtype=bool)
+    is_first[1:] = cells[1:] != cells[:-1]
+    first = np.maximum.accumulate(np.where(is_first, np.arange(len(cells)), 0))
+    rank = np.arange(len(cells)) - first
+    for r in range(rank.max() + 1 if len(rank) else 0):
+        at_rank = rank == r
+        correct[cells[at_rank]] += weights[order[at_rank]]
+
+    incorrect = counts["incorrect"]
+    possible = correct + incorrect + counts["missed"] + counts["partial"]
+    actual = correct + incorrect + counts["spurious"] + counts["partial"]
+    return np.stack([correct, possible, actual], axis=-1).reshape(
+        len(active), n_rows, len(WEIGHTED)
+    )
+
+
+def count_matches(true, pred, tags):
+    """
+    Compute the raw counters of all evaluation schemas for a corpus
+
+    :param true: a list of lists of true tags
+    :param pred: a list of lists of predicted tags
+    :param tags: entity types to evaluate
+    :return: a SpanCounts named-tuple (see match_spans)
+    """
+    true_lengths, true_ids, true_vocab = encode_tags(true)
+    pred_lengths, pred_ids, pred_vocab = encode_tags(pred)
+    if not np.array_equal(true_lengths, pred_lengths):
+        raise ValueError("Prediction length does not match true example length")
+    return _count_encoded(
+        true_lengths, true_ids, true_vocab, pred_ids, pred_vocab, tags
+    )
+
+
+def count_label_ids(true_ids, pred_ids, label_list, tags, ignore_index=-100):
+    """
+    Compute the raw counters of all evaluation schemas for tag ids, such as
+    the labels and argmax predictions of a token classification model,
+    without converting them back to lists of strings
+
+    :param true_ids: (sentences, tokens) array of true tag ids, where
+        ignore_index marks the positions to skip (special tokens, padding and
+        the sub-tokens following the first one of each word)
+    :param pred_ids: (sentences, tokens) array of predicted tag ids
+    :param label_list: the tags corresponding to the ids
+    :param tags: entity types to evaluate
+    :param ignore_index: id of the positions to skip in true_ids
+    :return: a SpanCounts named-tuple (see match_spans)
+    """
+    true_ids = np.asarray(true_ids)
+    pred_ids = np.asarray(pred_ids)
+    if true_ids.shape != pred_ids.shape:
+        raise ValueError("Prediction length does not match true example length")
+    keep = true_ids != ignore_index
+    label_list = list(label_list)
+    return _count_encoded(
+        keep.sum(axis=1), true_ids[keep], label_list, pred_ids[keep], label_list, tags
+    )
+
+
+def _count_encoded(lengths, true_ids, true_vocab, pred_ids, pred_vocab, tags):
+    tags = list(dict.fromkeys(tags))
+    gold_spans = collect_spans(lengths, true_ids, true_vocab, tags)
+    pred_spans = collect_spans(lengths, pred_ids, pred_vocab, tags)
+    aow = tags.index(AOW) if AOW in tags else -1
+    return match_spans(gold_spans, pred_spans, len(tags), aow)
@@ -0,0 +1,201 @@
+"""
+Run fine-tune.py over a grid of datasets, scenarios, models and seeds
+
+Runs are scheduled over a pool of processes, each one running fine-tune.py
+in-process so the imports, the loaded datasets and the tokenizers are shared
+by the runs it gets. Results are written in the layout read by the scripts of
+tables-and-stats:
+
+- <results_dir>/dataset<N>/[<scenario>/]seed<K> (--layout seeds)
+- <results_dir>/dataset<N>/[<scenario>/]<model basename> (--layout models)
+
+Arguments not listed below are passed to every fine-tune.py run, e.g.:
+    python3 music-ner/src/sweep.py --models bert-large-uncased --seeds 1 2 3
+    --num_workers 2 --threads_per_run 8 --do_train --do_predict
+    --num_train_epochs 3 --per_device_train_batch_size 16 --reinit_layers 1
+    --overwrite_output_dir --return_entity_level_metrics
+"""
+
+import argparse
+import importlib
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from itertools import product
+from os.path import basename, join
+
+logger = logging.getLogger(__name__)
+
+FULL_SCENARIO = "all"
+
+
+def run_dirs(data_dir, results_dir, dataset, scenario, model, seed, layout):
+    """
+    Return the data and output directories of a run
+    """
+    subdirs = [f"dataset{dataset}"]
+    if scenario != FULL_SCENARIO:
+        subdirs.append(scenario)
+    run_name = f"seed{seed}" if layout == "seeds" else basename(model)
+    return join(data_dir, *subdirs), join(results_dir, *subdirs, run_name)
+
+
+def init_worker(threads_per_run):
+    """
+    Limit the threads used by torch and import fine-tune.py once per worker
+    """
+    global fine_tune
+    if threads_per_run is not None:
+        os.environ["OMP_NUM_THREADS"] = str(threads_per_run)
+        os.environ["MKL_NUM_THREADS"] = str(threads_per_run)
+        import torch
+
+        torch.set_num_threads(threads_per_run)
+    fine_tune = importlib.import_module("fine-tune")
+
+
+def run(job):
+    """
+    Run fine-tune.py with the arguments of a job
+
+    :return: output directory, and duration in seconds or None if failed
+    """
+    output_dir, args = job
+    start = time.perf_counter()
+    try:
+        fine_tune.main(args)
+    except Exception:
+        logger.exception(f"Run {output_dir} failed")
+        return output_dir, None
+    return output_dir, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--data_dir",
+        dest="data_dir",
+        type=str,
+        help="Directory containing the dataset<N> directories",
+        default="data",
+    )
+    parser.add_argument(
+        "--results_dir",
+        dest="results_dir",
+        type=str,
+        help="Directory where to write the results",
+        default="output",
+    )
+    parser.add_argument(
+        "--datasets",
+        dest="datasets",
+        type=int,
+        nargs="+",
+        help="Dataset ids",
+        default=[1, 2, 3, 4],
+    )
+    parser.add_argument(
+        "--scenarios",
+        dest="scenarios",
+        type=str,
+        nargs="+",
+        help=f"Ground-truth sets: {FULL_SCENARIO}, seen and / or rare_unseen",
+        default=[FULL_SCENARIO],
+    )
+    parser.add_argument(
+        "--models",
+        dest="models",
+        type=str,
+        nargs="+",
+        help="Pretrained models",
+        default=["bert-large-uncased"],
+    )
+    parser.add_argument(
+        "--seeds", dest="seeds", type=int, nargs="+", help="Seeds", default=[1]
+    )
+    parser.add_argument(
+        "--layout",
+        dest="layout",
+        choices=["seeds", "models"],
+        help="Name the output directories after the seeds or the models",
+        default="seeds",
+    )
+    parser.add_argument(
+        "--dataset_name",
+        dest="dataset_name",
+        type=str,
+        help="Dataset loading script",
+        default="music-ner/datasets",
+    )
+    parser.add_argument(
+        "--num_workers",
+        dest="num_workers",
+        type=int,
+        help="Number of runs in parallel",
+        default=1,
+    )
+    parser.add_argument(
+        "--threads_per_run",
+        dest="threads_per_run",
+        type=int,
+        help="Number of CPU threads used by torch in each run",
+        default=None,
+    )
+    args, fine_tune_args = parser.parse_known_args()
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)],
+        level=logging.INFO,
+    )
+
+    if args.layout == "seeds" and len(args.models) > 1:
+        parser.error("--layout seeds requires a single model")
+    if args.layout == "models" and len(args.seeds) > 1:
+        parser.error("--layout models requires a single seed")
+
+    jobs = []
+    for dataset, scenario, model, seed in product(
+        args.datasets, args.scenarios, args.models, args.seeds
+    ):
+        data_dir, output_dir = run_dirs(
+            args.data_dir, args.results_dir, dataset, scenario, model, seed, args.layout
+        )
+        jobs.append(
+            (
+                output_dir,
+                [
+                    "--dataset_name",
+                    args.dataset_name,
+                    f"--dataset_path={data_dir}",
+                    "--model_name_or_path",
+                    model,
+                    "--output_dir",
+                    output_dir,
+                    "--seed",
+                    str(seed),
+                ]
+                + fine_tune_args,
+            )
+        )
+
+    logger.info(f"{len(jobs)} runs on {args.num_workers} workers")
+    failed = []
+    # Workers are spawned rather than forked, to start from a clean torch and
+    # tokenizers state
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(
+        args.num_workers, initializer=init_worker, initargs=(args.threads_per_run,)
+    ) as pool:
+        for output_dir, duration in pool.imap_unordered(run, jobs):
+            if duration is None:
+                failed.append(output_dir)
+            else:
+                logger.info(f"Run {output_dir} done in {duration:.1f}s")
+
+    if failed:
+        logger.error(f"{len(failed)} failed runs: {', '.join(failed)}")
+        sys.exit(1)
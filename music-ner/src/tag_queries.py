@@ -0,0 +1,291 @@
+"""
+Tag raw music recommendation queries with a checkpoint fine-tuned with
+fine-tune.py and write the entities found as JSON lines
+
+Queries are read lazily, grouped in buckets of similar length to limit
+padding, and run through the model on CPU without gradient tracking.
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from itertools import islice
+
+import numpy as np
+import torch
+from alignment import first_subtoken_predictions, word_id_matrix
+from ner_eval import collect_named_entities
+from query_io import read_queries
+from transformers import AutoConfig, AutoModelForTokenClassification, AutoTokenizer
+
+logger = logging.getLogger(__name__)
+
+
+# Weights of a model with dynamically quantized Linear layers, see quantize.py
+QUANTIZED_WEIGHTS = "pytorch_model_int8.bin"
+
+
+def quantize_dynamic(model):
+    """
+    Quantize the weights of the Linear layers to int8, activations being
+    quantized on the fly at inference
+    """
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def load_tokenizer(model_dir, config):
+    """
+    Load the fast tokenizer of a checkpoint as fine-tune.py does
+    """
+    if config.model_type in {"gpt2", "roberta"}:
+        return AutoTokenizer.from_pretrained(
+            model_dir, use_fast=True, add_prefix_space=True
+        )
+    return AutoTokenizer.from_pretrained(model_dir, use_fast=True)
+
+
+def label_names(config):
+    """
+    Array of the label names indexed by label id
+    """
+    return np.array([config.id2label[i] for i in range(len(config.id2label))])
+
+
+class QueryTagger:
+    """
+    Token classification model and tokenizer loaded from a fine-tune.py
+    output directory, tagging queries given as whitespace separated words
+
+    If the directory holds quantized weights (see quantize.py) or quantize is
+    set, the Linear layers run in int8.
+    """
+
+    # Type of the padded batches given to logits
+    return_tensors = "pt"
+
+    def __init__(self, model_dir, max_seq_length=None, quantize=False):
+        quantized_weights = os.path.join(model_dir, QUANTIZED_WEIGHTS)
+        if os.path.isfile(quantized_weights):
+            config = AutoConfig.from_pretrained(model_dir)
+            self.model = quantize_dynamic(
+                AutoModelForTokenClassification.from_config(config)
+            )
+            self.model.load_state_dict(torch.load(quantized_weights))
+        else:
+            self.model = AutoModelForTokenClassification.from_pretrained(model_dir)
+            if quantize:
+                self.model = quantize_dynamic(self.model)
+        # Whether the Linear layers run in int8
+        self.quantized = quantize or os.path.isfile(quantized_weights)
+        self.model.eval()
+        self.tokenizer = load_tokenizer(model_dir, self.model.config)
+        self.label_names = label_names(self.model.config)
+        self.max_seq_length = max_seq_length
+
+    def encode(self, words):
+        """
+        Tokenize lists of words, without padding
+        """
+        return self.tokenizer(
+            words,
+            truncation=True,
+            max_length=self.max_seq_length,
+            is_split_into_words=True,
+        )
+
+    def pad(self, encodings, indices):
+        """
+        Padded batch of the encoded sentences at the given indices
+        """
+        return self.tokenizer.pad(
+            [{key: encodings[key][i] for key in encodings.keys()} for i in indices],
+            return_tensors=self.return_tensors,
+        )
+
+    def logits(self, inputs):
+        """
+        Return the token logits of a padded batch as a numpy array
+        """
+        with torch.inference_mode():
+            return self.model(**inputs).logits.numpy()
+
+    def forward(self, inputs):
+        """
+        Return the predicted label ids of a padded batch
+        """
+        return self.logits(inputs).argmax(axis=-1)
+
+    def predict(self, words, batch_size=32):
+        """
+        Predict the tags of sentences given as lists of words, processed by
+        batches of similar lengths; words cut by truncation are tagged "O"
+        """
+        encodings = self.encode(words)
+        word_ids, lengths = word_id_matrix(encodings)
+        order = np.argsort(lengths, kind="stable")
+
+        tags = [None] * len(words)
+        for b in range(0, len(order), batch_size):
+            batch = order[b : b + batch_size]
+            predictions = self.forward(self.pad(encodings, batch))
+            for i, prediction in zip(
+                batch, first_subtoken_predictions(predictions, word_ids[batch])
+            ):
+                tags[i] = self.label_names[prediction].tolist()
+                tags[i] += ["O"] * (len(words[i]) - len(tags[i]))
+        return tags
+
+    def tag(self, queries, batch_size=32):
+        """
+        Tag a list of queries
+
+        :return: one list of entities per query, each entity being a dict
+            with its type, text and [start, end) word offsets
+        """
+        words = [query.split() for query in queries]
+        return [
+            [
+                {
+                    "type": ent.e_type,
+                    "text": " ".join(
+                        query_words[ent.start_offset : ent.end_offset + 1]
+                    ),
+                    "start": ent.start_offset,
+                    "end": ent.end_offset + 1,
+                }
+                for ent in collect_named_entities(tags)
+            ]
+            for query_words, tags in zip(words, self.predict(words, batch_size))
+        ]
+
+
+def load_tagger(
+    model_dir, backend="torch", max_seq_length=None, quantize=False, num_threads=None
+):
+    """
+    Load a QueryTagger running with PyTorch, or with ONNX Runtime from a
+    model exported with onnx_tagger.py
+    """
+    if backend == "onnx":
+        from onnx_tagger import OnnxQueryTagger
+
+        return OnnxQueryTagger(
+            model_dir, max_seq_length=max_seq_length, num_threads=num_threads
+        )
+    return QueryTagger(model_dir, max_seq_length=max_seq_length, quantize=quantize)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_dir",
+        dest="model_dir",
+        type=str,
+        help="Output directory of fine-tune.py (or one of its checkpoints)",
+        required=True,
+    )
+    parser.add_argument(
+        "--input_file",
+        dest="input_file",
+        type=str,
+        help="csv file (e.g. queries.csv), text file with one query per line, or - for stdin",
+        required=True,
+    )
+    parser.add_argument(
+        "--output_file",
+        dest="output_file",
+        type=str,
+        help="JSON lines file where to write the entities, stdout if not set",
+        default=None,
+    )
+    parser.add_argument(
+        "--text_column",
+        dest="text_column",
+        type=str,
+        help="Column of the queries in a csv input file",
+        default="preprocessed",
+    )
+    parser.add_argument(
+        "--batch_size", dest="batch_size", type=int, help="Batch size", default=32
+    )
+    parser.add_argument(
+        "--bucket_size",
+        dest="bucket_size",
+        type=int,
+        help="Number of queries read at once and sorted by length to form batches",
+        default=4096,
+    )
+    parser.add_argument(
+        "--max_seq_length",
+        dest="max_seq_length",
+        type=int,
+        help="Maximum number of tokens per query, longer queries are truncated",
+        default=None,
+    )
+    parser.add_argument(
+        "--backend",
+        dest="backend",
+        choices=["torch", "onnx"],
+        help="Run the model with PyTorch, or with ONNX Runtime from a model "
+        "exported with onnx_tagger.py",
+        default="torch",
+    )
+    parser.add_argument(
+        "--quantize",
+        dest="quantize",
+        action="store_true",
+        help="Run the Linear layers in int8 (dynamic quantization)",
+    )
+    parser.add_argument(
+        "--num_threads",
+        dest="num_threads",
+        type=int,
+        help="Number of CPU threads used by torch",
+        default=None,
+    )
+    args = parser.parse_args()
+    if args.backend == "onnx" and args.quantize:
+        parser.error("--quantize is only supported by the torch backend")
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stderr)],
+        level=logging.INFO,
+    )
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    tagger = load_tagger(
+        args.model_dir,
+        backend=args.backend,
+        max_seq_length=args.max_seq_length,
+        quantize=args.quantize,
+        num_threads=args.num_threads,
+    )
+    queries = read_queries(args.input_file, args.text_column)
+    writer = open(args.output_file, "w") if args.output_file else sys.stdout
+
+    n_queries = 0
+    n_words = 0
+    start = time.perf_counter()
+    while True:
+        bucket = list(islice(queries, args.bucket_size))
+        if not bucket:
+            break
+        for query, entities in zip(bucket, tagger.tag(bucket, args.batch_size)):
+            writer.write(json.dumps({"query": query, "entities": entities}) + "\n")
+        n_queries += len(bucket)
+        n_words += sum(len(query.split()) for query in bucket)
+        elapsed = time.perf_counter() - start
+        logger.info(
+            f"{n_queries} queries tagged in {elapsed:.1f}s "
+            f"({n_queries / elapsed:.1f} queries/s, {n_words / elapsed:.1f} words/s)"
+        )
+    if writer is not sys.stdout:
+        writer.close()
@@ -0,0 +1,135 @@
+"""
+Client of tagging_service.py, sending raw queries concurrently to load test
+the service and reporting the client-side latencies and the service metrics
+"""
+
+import argparse
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+import numpy as np
+from query_io import read_queries
+
+
+class TaggingClient:
+    """
+    Client of a tagging service running at url
+    """
+
+    def __init__(self, url="http://127.0.0.1:8000", timeout=30.0):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+    def tag(self, text):
+        """
+        :return: dict with the cleaned query and its entities
+        """
+        request = urllib.request.Request(
+            f"{self.url}/tag",
+            data=json.dumps({"text": text}).encode(),
+            headers={"Content-Type": "application/json"},
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read())
+
+    def metrics(self):
+        with urllib.request.urlopen(
+            f"{self.url}/metrics", timeout=self.timeout
+        ) as response:
+            return json.loads(response.read())
+
+
+def load_test(client, texts, concurrency):
+    """
+    Send the texts with concurrency requests in flight
+
+    :return: results, latencies in seconds and total duration
+    """
+
+    def timed_tag(text):
+        start = time.perf_counter()
+        result = client.tag(text)
+        return result, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as executor:
+        timed_results = list(executor.map(timed_tag, texts))
+    duration = time.perf_counter() - start
+    if not timed_results:
+        return [], np.array([]), duration
+    results, latencies = zip(*timed_results)
+    return list(results), np.array(latencies), duration
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--url",
+        dest="url",
+        type=str,
+        help="URL of the service",
+        default="http://127.0.0.1:8000",
+    )
+    parser.add_argument(
+        "--input_file",
+        dest="input_file",
+        type=str,
+        help="csv file (e.g. queries.csv), text file with one query per line, or - for stdin",
+        required=True,
+    )
+    parser.add_argument(
+        "--text_column",
+        dest="text_column",
+        type=str,
+        help="Column of the raw queries in a csv input file",
+        default="original",
+    )
+    parser.add_argument(
+        "--num_requests",
+        dest="num_requests",
+        type=int,
+        help="Number of queries sent, all if not set",
+        default=None,
+    )
+    parser.add_argument(
+        "--concurrency",
+        dest="concurrency",
+        type=int,
+        help="Number of requests in flight",
+        default=16,
+    )
+    parser.add_argument(
+        "--output_file",
+        dest="output_file",
+        type=str,
+        help="JSON lines file where to write the responses",
+        default=None,
+    )
+    args = parser.parse_args()
+
+    texts = list(
+        islice(read_queries(args.input_file, args.text_column), args.num_requests)
+    )
+    client = TaggingClient(args.url)
+    results, latencies, duration = load_test(client, texts, args.concurrency)
+
+    print(
+        f"{len(texts)} requests in {duration:.2f}s "
+        f"({len(texts) / duration:.1f} requests/s, concurrency {args.concurrency})"
+    )
+    if len(latencies):
+        print(
+            "Client latency (ms): "
+            + ", ".join(
+                f"p{p} {np.percentile(latencies, p) * 1000:.1f}" for p in [50, 90, 99]
+            )
+        )
+    print("Service metrics:")
+    print(json.dumps(client.metrics(), indent=4))
+    if args.output_file is not None:
+        with open(args.output_file, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
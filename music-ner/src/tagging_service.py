@@ -0,0 +1,367 @@
+"""
+HTTP service tagging raw music recommendation queries online
+
+Raw user text is cleaned with the WrittenQueryProcessor used to build the
+datasets, its sentences being joined with " | " as in the queries.csv files,
+then tagged with a checkpoint fine-tuned with fine-tune.py. Concurrent
+requests are coalesced into micro-batches by a dedicated model worker, which
+waits at most --max_wait_ms after the first query of a batch for others.
+
+Endpoints:
+- POST /tag {"text": "..."}: {"query": cleaned query, "entities": [...]}
+- GET /metrics: request latency percentiles and histogram, batch sizes, hits
+  and misses of the preprocessing cache
+- GET /health
+
+tagging_client.py sends queries to the service to load test it.
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import queue
+import sys
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import torch
+from tag_queries import load_tagger
+
+sys.path.append("music-ner/datasets")
+from preprocessing import WrittenQueryProcessor
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the buckets of the latency histogram
+LATENCY_BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+def clean_query(processor, text):
+    """
+    Preprocess raw text as the queries of the datasets, one sentence per
+    " | " separated segment
+    """
+    return " | ".join(processor.processing_pipeline([text])[0].split("\n"))
+
+
+class ServiceStats:
+    """
+    Thread-safe statistics of the request latencies and of the batch sizes
+
+    Percentiles are computed over the last window requests, histograms over
+    all of them.
+    """
+
+    def __init__(self, window=10000):
+        self.lock = threading.Lock()
+        self.latencies = deque(maxlen=window)
+        self.latency_histogram = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.batch_sizes = Counter()
+        self.n_requests = 0
+
+    def record_request(self, latency):
+        latency_ms = latency * 1000
+        with self.lock:
+            self.n_requests += 1
+            self.latencies.append(latency_ms)
+            self.latency_histogram[
+                bisect.bisect_left(LATENCY_BUCKETS_MS, latency_ms)
+            ] += 1
+
+    def record_batch(self, size):
+        with self.lock:
+            self.batch_sizes[size] += 1
+
+    def summary(self):
+        with self.lock:
+            latencies = np.array(self.latencies)
+            latency_histogram = list(self.latency_histogram)
+            batch_sizes = dict(sorted(self.batch_sizes.items()))
+            n_requests = self.n_requests
+
+        summary = {"requests": n_requests}
+        if len(latencies):
+            for p in [50, 90, 99]:
+                summary[f"latency_p{p}_ms"] = float(np.percentile(latencies, p))
+        summary["latency_histogram_ms"] = {
+            f"<={bound}": count
+            for bound, count in zip(LATENCY_BUCKETS_MS, latency_histogram)
+        }
+        summary["latency_histogram_ms"][f">{LATENCY_BUCKETS_MS[-1]}"] = (
+            latency_histogram[-1]
+        )
+        summary["batch_size_histogram"] = batch_sizes
+        n_batches = sum(batch_sizes.values())
+        if n_batches:
+            summary["mean_batch_size"] = (
+                sum(size * count for size, count in batch_sizes.items()) / n_batches
+            )
+        return summary
+
+
+class MicroBatcher:
+    """
+    Model worker tagging the queries submitted from other threads by batches
+
+    A batch is run when it has max_batch_size queries, or max_wait_ms after
+    its first query was taken from the queue.
+    """
+
+    def __init__(self, tagger, max_batch_size=32, max_wait_ms=5.0, stats=None):
+        self.tagger = tagger
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.stats = stats
+        self.queue = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.worker.start()
+
+    def submit(self, query):
+        """
+        Queue a query to tag
+
+        :return: Future of the list of entities of the query
+        """
+        future = Future()
+        self.queue.put((query, future))
+        return future
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                results = self.tagger.tag(
+                    [query for query, _ in batch], batch_size=len(batch)
+                )
+            except Exception as e:
+                logger.exception("Tagging failed")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), entities in zip(batch, results):
+                future.set_result(entities)
+            if self.stats is not None:
+                self.stats.record_batch(len(batch))
+
+
+class TaggingHandler(BaseHTTPRequestHandler):
+    """
+    Handler of the requests of a TaggingServer
+    """
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            summary = self.server.stats.summary()
+            summary["preprocessing_cache"] = self.server.processor.cache_info()
+            self.send_json(200, summary)
+        elif self.path == "/health":
+            self.send_json(200, {"status": "ok"})
+        else:
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        if self.path != "/tag":
+            self.send_json(404, {"error": f"Unknown path {self.path}"})
+            return
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            text = json.loads(self.rfile.read(length))["text"]
+            if not isinstance(text, str):
+                raise TypeError
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {"error": 'Expected a json body {"text": "..."}'})
+            return
+
+        query = clean_query(self.server.processor, text)
+        entities = []
+        if query:
+            try:
+                entities = self.server.batcher.submit(query).result(
+                    self.server.request_timeout
+                )
+            except FutureTimeoutError:
+                self.send_json(503, {"error": "Timeout"})
+                return
+            except Exception as e:
+                self.send_json(500, {"error": str(e)})
+                return
+        self.server.stats.record_request(time.perf_counter() - start)
+        self.send_json(200, {"query": query, "entities": entities})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class TaggingServer(ThreadingHTTPServer):
+    """
+    HTTP server handling each request in a thread, the tagging itself being
+    done by the batcher
+    """
+
+    daemon_threads = True
+    # Accept bursts of concurrent connections
+    request_queue_size = 128
+
+    def __init__(self, address, processor, batcher, stats, request_timeout=10.0):
+        super().__init__(address, TaggingHandler)
+        self.processor = processor
+        self.batcher = batcher
+        self.stats = stats
+        self.request_timeout = request_timeout
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--model_dir",
+        dest="model_dir",
+        type=str,
+        help="Output directory of fine-tune.py (or of onnx_tagger.py / quantize.py)",
+        required=True,
+    )
+    parser.add_argument(
+        "--host", dest="host", type=str, help="Host", default="127.0.0.1"
+    )
+    parser.add_argument("--port", dest="port", type=int, help="Port", default=8000)
+    parser.add_argument(
+        "--max_batch_size",
+        dest="max_batch_size",
+        type=int,
+        help="Maximum number of queries per batch",
+        default=32,
+    )
+    parser.add_argument(
+        "--max_wait_ms",
+        dest="max_wait_ms",
+        type=float,
+        help="Maximum time waited for other queries after the first one of a batch",
+        default=5.0,
+    )
+    parser.add_argument(
+        "--request_timeout",
+        dest="request_timeout",
+        type=float,
+        help="Time in seconds after which a request fails",
+        default=10.0,
+    )
+    parser.add_argument(
+        "--sentence_splitter",
+        dest="sentence_splitter",
+        choices=["nltk", "simple"],
+        help="Sentence splitter of the preprocessing: nltk's Punkt, or a "
+        "lightweight splitter agreeing with it on the queries of the datasets",
+        default="simple",
+    )
+    parser.add_argument(
+        "--preprocessing_cache_size",
+        dest="preprocessing_cache_size",
+        type=int,
+        help="Number of distinct raw queries whose preprocessing is cached, 0 to "
+        "disable the cache",
+        default=100000,
+    )
+    parser.add_argument(
+        "--backend",
+        dest="backend",
+        choices=["torch", "onnx"],
+        help="Run the model with PyTorch, or with ONNX Runtime from a model "
+        "exported with onnx_tagger.py",
+        default="torch",
+    )
+    parser.add_argument(
+        "--quantize",
+        dest="quantize",
+        action="store_true",
+        help="Run the Linear layers in int8 (dynamic quantization)",
+    )
+    parser.add_argument(
+        "--max_seq_length",
+        dest="max_seq_length",
+        type=int,
+        help="Maximum number of tokens per query, longer queries are truncated",
+        default=None,
+    )
+    parser.add_argument(
+        "--num_threads",
+        dest="num_threads",
+        type=int,
+        help="Number of CPU threads used by the model",
+        default=None,
+    )
+    args = parser.parse_args()
+    if args.backend == "onnx" and args.quantize:
+        parser.error("--quantize is only supported by the torch backend")
+
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(name)s - %(message)s",
+        datefmt="%m/%d/%Y %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stderr)],
+        level=logging.INFO,
+    )
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    tagger = load_tagger(
+        args.model_dir,
+        backend=args.backend,
+        max_seq_length=args.max_seq_length,
+        quantize=args.quantize,
+        num_threads=args.num_threads,
+    )
+    stats = ServiceStats()
+    batcher = MicroBatcher(
+        tagger,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        stats=stats,
+    )
+    batcher.start()
+
+    server = TaggingServer(
+        (args.host, args.port),
+        WrittenQueryProcessor(
+            fast=True,
+            sentence_splitter=args.sentence_splitter,
+            cache_size=args.preprocessing_cache_size,
+        ),
+        batcher,
+        stats,
+        request_timeout=args.request_timeout,
+    )
+    logger.info(f"Serving on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()